@@ -0,0 +1,335 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import json, os, re, subprocess, tempfile, threading
+from typing import Dict, List, Optional, Tuple
+from util import canonicalize, canonicalize_names, red, restore_names, yellow
+from inprocess import InProcessMeson
+from forkserver import ForkServer, Watchdog, kill_group, wait_exited
+from cache import ResultCache
+
+"""
+Backends run the checks of a buildfile. A check consists of the lines of the
+buildfile (the prelude) followed by the lines of the check, a backend returns
+the line of the first error (relative to the lines of the check, -1 if there is none)
+and the error message.
+
+MesonBackend and its subclasses evaluate the meson.build file with meson:
+    subprocess: runs 'meson --reconfigure' for each check
+    forkserver: forks a process, that has already imported meson (see forkserver.py)
+    snapshot:   forks an interpreter, that has already interpreted the prelude
+    inprocess:  runs the meson interpreter inside this process (see inprocess.py)
+The stub backend answers checks without meson (from rules or a recorded table),
+so that generators, checkers and the scheduler can be measured and tested on their own.
+"""
+
+# If an error line contains this substring, the error is skipped
+IGNORE_STRING = "$IGNORE$"
+
+# Error in the meson.build file, as printed by 'meson --reconfigure'
+ERROR_LINE = re.compile(r"\.\.[\\\/]meson\.build:(\d+):\d+: ERROR: .*")
+
+class OutputParser:
+    """Parses the output of 'meson --reconfigure' line by line, until the first relevant error is found."""
+
+    def __init__(self, lines_before: int, warnings: bool):
+        self.lines_before = lines_before
+        self.warnings = warnings
+        self.error_line = -1
+        self.error_msg = ""
+
+    def feed(self, stdout_line: str) -> bool:
+        """Parses a line of the output. Returns True, if the result is known (the remaining output is irrelevant)."""
+        # The error line is the last statement of the file, nothing after it matters
+        if IGNORE_STRING in stdout_line:
+            return True
+        # Check if line is error
+        match = ERROR_LINE.match(stdout_line)
+        if match:
+            self.error_msg = stdout_line.split("ERROR:")[1].strip()
+            self.error_line = int(match.group(1))
+            return True
+        # Check if line is warning
+        elif "WARNING" in stdout_line and self.warnings:
+            self.error_msg = stdout_line.split("WARNING:")[1].strip() + yellow(" (WARNING)")
+            self.error_line = self.lines_before + 1
+            return True
+        # If line contains ERROR -> regex might be out of date
+        elif "ERROR" in stdout_line:
+            if "ERROR: First statement must be a call to project" in stdout_line:
+                print(f"{yellow('<INTERNAL>')} No project() call in meson.build file.")
+                self.error_line = self.lines_before + 1
+            else:
+                print(f"{yellow('<INTERNAL>')} ERROR line found, but regex didn't match. Did the formatting change?")
+        return False
+
+def parse_output(stdout: str, lines_before: int, warnings: bool) -> Tuple[int, str]:
+    """Parses the output of 'meson --reconfigure'. Returns error line and error message."""
+    parser = OutputParser(lines_before, warnings)
+    for stdout_line in stdout.split(os.linesep):
+        if parser.feed(stdout_line):
+            break
+    return parser.error_line, parser.error_msg
+
+def interpreter_result(result: Tuple[int, str, str, str], lines_before: int, warnings: bool) -> Tuple[int, str, str, str]:
+    """Evaluates the result of a meson interpreter (see inprocess.py). Returns error line, error message, log and traceback."""
+    error_line, error_msg, log, crash = result
+
+    # Warnings are written to the log before the error is raised, so they are reported first
+    if warnings:
+        for log_line in log.split("\n"):
+            if "WARNING:" in log_line:
+                return lines_before + 1, log_line.split("WARNING:")[1].strip() + yellow(" (WARNING)"), log, crash
+
+    # Ignore error line
+    if IGNORE_STRING in error_msg:
+        return -1, "", log, crash
+
+    if "First statement must be a call to project" in error_msg:
+        print(f"{yellow('<INTERNAL>')} No project() call in meson.build file.")
+        return lines_before + 1, "", log, crash
+
+    # Error is not located in the meson.build file
+    if error_line < 0 and len(error_msg) > 0:
+        print(f"{yellow('<INTERNAL>')} ERROR found outside of meson.build: {error_msg}")
+        return -1, "", log, crash
+
+    return error_line, error_msg, log, crash
+
+class Backend:
+    """Interface of a backend. A backend belongs to a single buildfile."""
+
+    # Whether the buildfile has to configure a meson build directory for this backend
+    requires_meson = True
+
+    def __init__(self, bf):
+        self.bf = bf
+
+    def check(self, lines: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+        """
+        Runs a check of the given lines, following the lines of the buildfile. Returns error line and error message.
+        Raises a TimeoutError, if the check did not finish within timeout seconds.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases resources of the backend (e.g. processes)."""
+        pass
+
+class MesonBackend(Backend):
+    """Base class of the backends, that evaluate the meson.build file of the buildfile with meson."""
+
+    def check(self, lines: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+        bf = self.bf
+        # Check how many lines are in the file before appending
+        lines_before = bf.line_count()
+
+        # Add error line to lines. This makes meson run significantly faster, and doesn't change the result.
+        lines = list(lines) + [f"error('{bf.error_line()}')"]
+        bf.write_check(lines)
+
+        error_line, error_msg, stdout, stderr = self._run(lines_before, timeout)
+
+        # 'meson --reconfigure' does not write to stderr, so if something was written, meson has crashed
+        if len(stderr) > 0 and not bf.verbose:
+            error_msg = f"{red('<CRASH>')} Meson has crashed, re-run with --verbose to see stderr."
+            error_line = lines_before + 1 # arbitrary number, so that test won't be re-run
+
+        # If output is verbose, print stderr aswell
+        elif len(stderr) > 0 and bf.verbose:
+            print(stderr)
+            error_msg = f"{red('<CRASH>')} Meson has crashed."
+            error_line = lines_before + 1 # arbitrary number, so that test won't be re-run
+
+        # if output is verbose, print buildfile contents and stdout
+        if error_line >= 0 and bf.verbose:
+            print("######## MESON.BUILD CONTENTS ########")
+            with open(bf.buildfile, "r") as file:
+                print(file.read())
+            print("########## STDOUT CONTENTS ###########")
+            print(stdout)
+
+        # Errors before the checked lines (or none at all) are reported as -1
+        return max(error_line - lines_before - 1, -1), error_msg
+
+    def _run(self, lines_before: int, timeout: Optional[float]) -> Tuple[int, str, str, str]:
+        """Evaluates the meson.build file. Returns error line (in the file), error message, stdout and stderr."""
+        raise NotImplementedError
+
+    def _builddir(self) -> str:
+        return os.path.join(self.bf.src_folder.name, "builddir")
+
+class SubprocessBackend(MesonBackend):
+    """Runs 'meson --reconfigure' for each check."""
+
+    def _run(self, lines_before: int, timeout: Optional[float]) -> Tuple[int, str, str, str]:
+        """
+        Runs 'meson --reconfigure' and parses its output while it is running.
+        Meson is killed as soon as the result is known (unless the output is verbose), so its teardown is not waited for.
+        Raises a TimeoutError, if meson has been killed, because it did not finish within timeout seconds.
+        """
+        parser = OutputParser(lines_before, self.bf.warnings)
+        stdout_lines = []
+        # stderr is only read afterwards, so it must not be a pipe (a full pipe would block meson)
+        with tempfile.TemporaryFile() as stderr_file:
+            # Meson gets its own process group, so that processes started by meson (e.g. compilers) are killed aswell
+            process = subprocess.Popen(["meson", "--reconfigure"], cwd=self._builddir(), stdout=subprocess.PIPE, stderr=stderr_file,
+                                        start_new_session=True)
+            watchdog = Watchdog(process.pid, timeout)
+            decided = False # Whether the result is known
+            try:
+                for stdout_line in process.stdout:
+                    stdout_line = stdout_line.decode().rstrip("\n")
+                    stdout_lines.append(stdout_line)
+                    # Verbose output is read to the end, but only parsed until the result is known (like without --verbose)
+                    decided = decided or parser.feed(stdout_line)
+                    if decided and not self.bf.verbose:
+                        kill_group(process.pid)
+                        break
+            except BaseException:
+                # Meson has its own session, so an interrupt (or any other error) doesn't reach it
+                kill_group(process.pid)
+                raise
+            finally:
+                process.stdout.close()
+                # The watchdog is stopped before meson is reaped, so it never kills a reaped process group
+                wait_exited(process.pid)
+                watchdog.cancel()
+                process.wait()
+            # The watchdog might fire just after meson has finished on its own (or after the result is known)
+            if watchdog.expired and not decided and process.returncode < 0:
+                raise TimeoutError(f"Meson did not finish within {timeout:g} seconds.")
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode()
+        return parser.error_line, parser.error_msg, "\n".join(stdout_lines), stderr
+
+class ForkServerBackend(MesonBackend):
+    """Runs 'meson --reconfigure' in a fork of a process, that has already imported meson."""
+
+    def __init__(self, bf):
+        super().__init__(bf)
+        self.forkserver = ForkServer()
+
+    def _run(self, lines_before: int, timeout: Optional[float]) -> Tuple[int, str, str, str]:
+        stdout, stderr = self.forkserver.run(self._builddir(), timeout)
+        error_line, error_msg = parse_output(stdout, lines_before, self.bf.warnings)
+        return error_line, error_msg, stdout, stderr
+
+    def close(self):
+        self.forkserver.close()
+
+class SnapshotBackend(ForkServerBackend):
+    """Interprets the lines of a check in a fork of an interpreter, that has already interpreted the prelude."""
+
+    def _run(self, lines_before: int, timeout: Optional[float]) -> Tuple[int, str, str, str]:
+        # Without a prelude (e.g. while checking project()), there is nothing to snapshot
+        if lines_before == 0:
+            return super()._run(lines_before, timeout)
+        result = self.forkserver.run_snapshot(self.bf.src_folder.name, self._builddir(), lines_before, timeout)
+        return interpreter_result(result, lines_before, self.bf.warnings)
+
+class InProcessBackend(MesonBackend):
+    """Runs the meson interpreter inside of this process. It can't be interrupted, so timeouts are not supported."""
+
+    def __init__(self, bf):
+        super().__init__(bf)
+        self.inprocess = InProcessMeson(bf.src_folder.name, self._builddir())
+
+    def _run(self, lines_before: int, timeout: Optional[float]) -> Tuple[int, str, str, str]:
+        return interpreter_result(self.inprocess.run(), lines_before, self.bf.warnings)
+
+class StubTable:
+    """
+    Rules and recorded results for the stub backend, stored as a JSON file:
+        { "rules" : [ { "pattern" : <regex>, "message" : <error message> }, ... ],
+          "table" : { <key of check> : [ <error line>, <error message> ], ... },
+          "default" : [ <error line>, <error message> ] }
+    The default result (optional) is used for checks, that are neither recorded nor matched by a rule.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.rules: List[Tuple[re.Pattern, str]] = []
+        self.table: Dict[str, List] = {}
+        self.default: Optional[List] = None
+        # Guards the table, which is shared by the backends of all buildfiles
+        self.lock = threading.Lock()
+        if path != None and os.path.exists(path):
+            with open(path, "r") as file:
+                data = json.load(file)
+            self.rules = [ (re.compile(rule["pattern"]), rule.get("message", "")) for rule in data.get("rules", []) ]
+            self.table = data.get("table", {})
+            self.default = data.get("default")
+
+    @staticmethod
+    def key(prelude: str, lines: List[str]) -> Tuple[str, List[str]]:
+        """
+        Returns the key of a check in the table, and the names generated for the check (see util.canonicalize()).
+        Checks that only differ in generated names have the same key, so a recording can be replayed in another run.
+        """
+        canonical_lines, names = canonicalize([prelude, *lines])
+        return ResultCache.key(*canonical_lines), names
+
+    def lookup(self, prelude: str, lines: List[str]) -> Optional[Tuple[int, str]]:
+        """Returns the recorded result of a check, the result of the first matching rule, or the default result (None, if there is none)."""
+        key, names = StubTable.key(prelude, lines)
+        with self.lock:
+            result = self.table.get(key)
+        if result != None:
+            return result[0], restore_names(result[1], names)
+        for index, line in enumerate(lines):
+            for pattern, message in self.rules:
+                if pattern.search(line):
+                    return index, message
+        return None if self.default == None else (self.default[0], self.default[1])
+
+    def record(self, prelude: str, lines: List[str], result: Tuple[int, str]):
+        """Records the result of a check."""
+        key, names = StubTable.key(prelude, lines)
+        with self.lock:
+            self.table[key] = [ result[0], canonicalize_names(result[1], names) ]
+
+    def save(self):
+        """Writes rules and recorded results to the file."""
+        data = { "rules" : [ { "pattern" : pattern.pattern, "message" : message } for pattern, message in self.rules ],
+                 "table" : self.table }
+        if self.default != None:
+            data["default"] = self.default
+        with self.lock:
+            with open(self.path, "w") as file:
+                json.dump(data, file, indent=1)
+
+class StubBackend(Backend):
+    """
+    Answers checks without running meson: from the recorded results of a StubTable, or its rules
+    (the first line of a check matched by a rule fails). Results are deterministic, and checks are (almost) free.
+    """
+
+    requires_meson = False
+
+    def __init__(self, bf, table: StubTable = None):
+        super().__init__(bf)
+        self.table = StubTable() if table == None else table
+
+    def check(self, lines: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+        result = self.table.lookup(self.bf.prelude(), list(lines))
+        # An incomplete table must not turn unknown checks into successful ones
+        if result == None:
+            return 0, f"{yellow('<STUB MISS>')} No recorded result or matching rule for this check."
+        return result
+
+BACKENDS = { "subprocess" : SubprocessBackend, "forkserver" : ForkServerBackend, "snapshot" : SnapshotBackend,
+             "inprocess" : InProcessBackend, "stub" : StubBackend }
+
+def backend_class(name: str) -> type:
+    """Returns the backend class with the given name."""
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown backend '{name}'.")
+    return BACKENDS[name]
+
+def create_backend(name: str, bf, stub_table: StubTable = None) -> Backend:
+    """Creates the backend with the given name for the buildfile."""
+    if name == "stub":
+        return StubBackend(bf, stub_table)
+    return backend_class(name)(bf)
\ No newline at end of file
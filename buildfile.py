@@ -2,72 +2,184 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import tempfile, os, subprocess, shutil, re, errno, templates
-from typing import List, Tuple
-from util import red, varname, yellow
+import os, subprocess, re, hashlib, time, templates
+from typing import List, Optional, Tuple
+from util import canonicalize, canonicalize_names, restore_names, yellow
+from backends import IGNORE_STRING, StubTable, backend_class, create_backend
+from cache import ResultCache, ResultMemo
+from workspace import PersistentWorkspace, TemporaryWorkspace, WorkspaceManager, clone_builddir, link_tree, meson_version, remove_path
 
 class MesonException(Exception):
     pass
 
-# If an error line contains this substring, the error is skipped
-IGNORE_STRING = "$IGNORE$"
+# Snippets calling one of these functions may stop the evaluation of the meson.build file
+# without an error, so they can't be batched with other snippets
+TERMINATING_CALL = re.compile(r"(^|[^\w.])(error|subdir_done)\s*\(")
+
+# Lines of the 'meson setup' output, that describe meson and the toolchain
+TOOLCHAIN_LINE = re.compile(r"(Version:|.* (compiler|linker) for the \w+ machine:)")
+
+# The disk usage of the workspaces is checked after this many checks
+BUDGET_INTERVAL = 20
+
+# Error line of a check, that has been killed because it did not finish in time
+# (not an integer, so it can't be confused with the line of a result, which may be negative)
+TIMEOUT_LINE = float("-inf")
+
+def file_digest(path: str) -> str:
+    """Returns a hash of the given file, or of all files in the given directory."""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                digest.update(os.path.relpath(file, path).encode() + b"\0")
+                with open(file, "rb") as f:
+                    digest.update(f.read())
+    else:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
 
 class BuildFile:
-    """Wrapper for the meson.build file. Provides methods for adding/removing lines and running checks."""
-
-    # Buffer that is used to push/pop file contents
-    push_buffer = ""
+    """
+    Wrapper for the meson.build file. Provides methods for adding/removing lines and running checks.
+    The lines are kept in memory (already encoded), the file is only written once per check.
+    """
 
     def __init__(self, project_name: str = "generated",
                     project_languages: str = ["c"],
                     warnings: bool = False,
-                    verbose: bool = False):
+                    verbose: bool = False,
+                    batch_size: int = 1,
+                    backend: str = "subprocess",
+                    cache: ResultCache = None,
+                    timeout: float = None,
+                    deadline: float = None,
+                    workspaces: WorkspaceManager = None,
+                    workspace: str = None,
+                    memo: ResultMemo = None,
+                    stub_table: StubTable = None,
+                    record_table: StubTable = None,
+                    template: "BuildFile" = None,
+                    quiet: bool = False):
+        # Settings, that are required to create an isolated buildfile (see isolated())
+        self.settings = dict(project_name=project_name, project_languages=project_languages, warnings=warnings, verbose=verbose,
+                            batch_size=batch_size, backend=backend, cache=cache, timeout=timeout, deadline=deadline,
+                            workspaces=workspaces, memo=memo, stub_table=stub_table, record_table=record_table)
+        self.isolated_bf = None # Created on first use
+        log = (lambda *args: None) if quiet else print
         self.warnings = warnings
         self.verbose = verbose
-
-        self.src_folder = tempfile.TemporaryDirectory()
-        print(f"Setting up directory: '{self.src_folder.name}'")
+        self.batch_size = batch_size # Maximum number of snippets that are checked in a single meson run
+        self.cache = cache # Persistent cache for results of checks (optional)
+        self.memo = ResultMemo() if memo == None else memo # Results of the checks of this run
+        self.timeout = timeout # Maximum duration of a check in seconds (optional)
+        self.deadline = deadline # time.monotonic() after which no more checks are run (optional)
+
+        # Backend that runs the checks (see backends.py)
+        requires_meson = backend_class(backend).requires_meson
+
+        # A persistent workspace is reused, if it was configured for the same meson version and languages
+        if workspace != None and requires_meson:
+            key = { "meson" : meson_version(), "project" : project_name, "languages" : project_languages }
+            self.src_folder = PersistentWorkspace(workspace, key)
+            setup_output = self.src_folder.setup_output
+        # Otherwise, a temporary workspace is created (and removed again) by the workspace manager
+        else:
+            workspaces = WorkspaceManager() if workspaces == None else workspaces
+            self.src_folder = workspaces.create()
+            setup_output = None
+        # Manager, whose disk budget is checked while checks are run (None for a persistent workspace)
+        self.workspaces = workspaces if isinstance(self.src_folder, TemporaryWorkspace) else None
+        self.check_count = 0 # Number of checks run by the backend
+        log(f"Setting up directory: '{self.src_folder.name}'")
         self.buildfile = os.path.join(self.src_folder.name, "meson.build")
+        self.lines = [] # Encoded lines of the meson.build file (without the lines of a check)
+        self.content = None # All lines joined, created on demand
         
         # Creating and adding project information to meson.build file
         project_languages = [ f"'{lang}'" for lang in project_languages ]
         self.append_line(f"project('{project_name}', [{', '.join(project_languages)}])")
+        self._write()
+
+        # Backends that don't run meson don't need a build directory
+        if not requires_meson:
+            setup_output = ""
+        elif setup_output != None:
+            log("Reusing configured workspace ...")
+        # Copy the build directory of an already configured buildfile
+        elif template != None:
+            log("Cloning configured build directory ...")
+            if clone_builddir(template.src_folder.name, self.src_folder.name):
+                setup_output = template.setup_output
+                if workspace != None:
+                    self.src_folder.configured(setup_output)
+            else:
+                log("Build directory references its source directory, it can't be cloned.")
 
         # Generate meson structure
-        print("Running meson setup ...")
-        result = subprocess.run(["meson", "setup", "builddir"], cwd=self.src_folder.name, capture_output=True)
-        if result.returncode != 0:
-            print("Something went wrong:")
-            print(result.stdout.decode("utf-8"))
-            raise RuntimeError("Could not create buildfile.")
+        if setup_output == None:
+            log("Running meson setup ...")
+            result = subprocess.run(["meson", "setup", "builddir"], cwd=self.src_folder.name, capture_output=True)
+            if result.returncode != 0:
+                print("Something went wrong:")
+                print(result.stdout.decode("utf-8"))
+                raise RuntimeError("Could not create buildfile.")
+            setup_output = result.stdout.decode()
+            if workspace != None:
+                self.src_folder.configured(setup_output)
+
+        if self.workspaces != None:
+            self.workspaces.check_budget(self.src_folder)
+
+        self.setup_output = setup_output
+        # Everything besides the meson.build file that influences results (meson version, toolchain, added files)
+        self.fingerprint = "\n".join(line for line in setup_output.split("\n") if TOOLCHAIN_LINE.match(line))
+
+        self.backend = create_backend(backend, self, stub_table)
+        self.record_table = record_table # Results of all checks are recorded into it (for the stub backend, optional)
+
+        log("Done!")
+
+    def _encode(self, line: str) -> bytes:
+        """Returns a line as it is written to the meson.build file. Removes linebreaks."""
+        line = line.replace(templates.BUILDFILE_DIR, f"'{self.src_folder.name}'")
+        escaped_line = line.replace("\n", "\\n")
+        return (escaped_line + "\n").encode()
+
+    def _set_lines(self, lines: List[bytes]):
+        self.lines = lines
+        self.content = None
 
-        print("Done!")
+    def _content(self) -> bytes:
+        """Returns the contents of the meson.build file (without the lines of a check)."""
+        if self.content == None:
+            self.content = b"".join(self.lines)
+        return self.content
+
+    def _write(self, body: bytes = b""):
+        """Writes the meson.build file, followed by the given (encoded) lines."""
+        fd = os.open(self.buildfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.writev(fd, [self._content(), body])
+        finally:
+            os.close(fd)
 
     def append_line(self, line: str = ""):
         """Appends a single line to the meson.build file. Removes linebreaks."""
-        line = line.replace(templates.BUILDFILE_DIR, f"'{self.src_folder.name}'")
-        escaped_line = line.replace("\n", "\\n")
-        with open(self.buildfile, "a") as file:
-            file.write(escaped_line + "\n")
+        self._set_lines(self.lines + [self._encode(line)])
 
     def append_lines(self, lines: List[str]):
         """Appends multiplie lines to the meson.build file. Removes linebreaks."""
-        with open(self.buildfile, "a") as file:
-            for line in lines:
-                line = line.replace(templates.BUILDFILE_DIR, f"'{self.src_folder.name}'")
-                escaped_line = line.replace("\n", "\\n")
-                file.write(escaped_line + "\n")
+        self._set_lines(self.lines + [ self._encode(line) for line in lines ])
 
     def remove_line(self, index: int):
         """Removes the line with the given index from the meson.build file."""
-        # Read current lines from file
-        with open(self.buildfile, "r") as readfile:
-            lines = readfile.readlines()
-        # Remove selected line
+        lines = list(self.lines)
         del lines[index]
-        # Write remaining lines back to file
-        with open(self.buildfile, "w") as writefile:
-            writefile.writelines(lines)
+        self._set_lines(lines)
 
     def pop_line(self):
         """Removes the last line from the meson.build file."""
@@ -77,129 +189,249 @@ class BuildFile:
         """Removes n lines from the meson.build file, starting at the last line."""
         if n < 0:
             raise ValueError(f"Cannot pop a negative number ({n}) of lines.")
-
-        # Read current lines from file
-        with open(self.buildfile, "r") as readfile:
-            lines = readfile.readlines()
-
-        if n > len(lines):
-            raise ValueError(f"Can only pop {len(lines)} lines (not {n}).")
-
-        # Remove selected lines
-        for i in range(n):
-            del lines[-1]
-
-        # Write remaining lines back to file
-        with open(self.buildfile, "w") as writefile:
-            writefile.writelines(lines)
-
-    def push_content(self):
-        """Stores meson.build file content in a buffer. Can be restored via pop_content()"""
-        # Store contents in buffer
-        with open(self.buildfile, "r") as readfile:
-            self.push_buffer = readfile.read()
-        # Clear file contents
-        open(self.buildfile, "w").close()
-    
-    def pop_content(self):
-        """Retrieves file contents from the buffer and writes it to the meson.build file"""
-        # Store buffer in file
-        with open(self.buildfile, "w") as writefile:
-            writefile.write(self.push_buffer)
+        if n > len(self.lines):
+            raise ValueError(f"Can only pop {len(self.lines)} lines (not {n}).")
+        self._set_lines(self.lines[:len(self.lines) - n])
 
     def line_count(self) -> int:
         """Returns the number of lines of the meson.build file"""
-        with open(self.buildfile, "r") as readfile:
-            return len(readfile.readlines())
+        return len(self.lines)
 
     def get_line(self, index: int) -> str:
         """Returns the line with the given index."""
-        with open(self.buildfile, "r") as file:
-            lines = file.readlines
-            return lines[index].rstrip("\n")
+        return self.lines[index].decode().rstrip("\n")
+
+    def isolated(self) -> "BuildFile":
+        """
+        Returns a buildfile with the same settings, but its own workspace and an empty meson.build file
+        (e.g. for checks of project(), which must be the first statement). It is created on first use.
+        """
+        if self.isolated_bf == None:
+            self.isolated_bf = BuildFile(**self.settings, template=self, quiet=True)
+            self.isolated_bf._set_lines([])
+        return self.isolated_bf
 
     def add_file(self, name: str, src_file: str):
-        """Copies a file to the source folder of the buildfile."""
+        """Links a file (or directory) to the source folder of the buildfile. Checks must not modify it."""
         dest_file= os.path.join(self.src_folder.name, name)
-        try:
-            shutil.copytree(src_file, dest_file)
-        except OSError as exc:
-            if exc.errno == errno.ENOTDIR:
-                shutil.copy(src_file, dest_file)
-            else:
-                raise
+        self.fingerprint += f"\n{name}:{file_digest(src_file)}"
+        # A reused workspace still contains the files of the previous run
+        remove_path(dest_file)
+        link_tree(src_file, dest_file)
+        if self.workspaces != None:
+            self.workspaces.check_budget()
+
+    def prelude(self) -> str:
+        """Returns the lines of the meson.build file (without the lines of a check), independent of the workspace."""
+        return self._content().decode().replace(f"'{self.src_folder.name}'", templates.BUILDFILE_DIR)
+
+    def write_check(self, lines: List[str]):
+        """Writes the meson.build file with the given lines appended (they are not kept, so nothing has to be removed afterwards)."""
+        self._write(b"".join(self._encode(line) for line in lines))
 
     def error_line(self) -> str:
         """Returns the error line used to speed up checks."""
         return f"This error is produced to speed up checks and can be ignored ({IGNORE_STRING})"
 
+    def check_key(self, lines: List[str]) -> Tuple[str, List[str]]:
+        """
+        Returns the key of a check of the given lines, and the names generated for the check (see util.canonicalize()).
+        Checks that only differ in generated names have the same key.
+        """
+        canonical_lines, names = canonicalize([self._content().decode(), *lines])
+        return ResultCache.key(self.fingerprint, str(self.warnings), *canonical_lines), names
+
+    def _stored_result(self, key: str, names: List[str]) -> Optional[Tuple[int, str]]:
+        """Returns the result of an equivalent check of this run or of the persistent cache, or None."""
+        # Verbose output requires running meson
+        if self.verbose:
+            return None
+        result = self.memo.get(key)
+        if result == None and self.cache != None:
+            result = self.cache.get(key)
+        if result == None:
+            return None
+        return max(result[0], -1), restore_names(result[1], names)
+
     def check_lines(self, lines: List[str]) -> Tuple[int, str]:
         """Adds the given lines to the buildfile and runs a check. Returns error line and error message."""
         if not isinstance(lines, list) and not isinstance(lines, tuple):
             lines = (lines,)
-        # Check how many lines are in the file before appending
-        lines_before = self.line_count()
+        # Return the stored result, if an equivalent check has been run before
+        key, names = self.check_key(lines)
+        result = self._stored_result(key, names)
+        if result != None:
+            self._record(lines, result)
+            return result
 
-        # Add error line to lines. This makes meson run significantly faster, and doesn't change the result.
-        lines.append(f"error('{self.error_line()}')")
+        try:
+            result = self.backend.check(lines, self._timeout())
+        # Timeouts are neither stored nor caused by the checked lines
+        except TimeoutError as e:
+            message = str(e)
+            if self.deadline != None and time.monotonic() >= self.deadline and "Global" not in message:
+                message = "Global timeout exceeded, check was killed."
+            return TIMEOUT_LINE, f"{yellow('<TIMEOUT>')} {message}"
+
+        # Checks write into the build directory, so the disk usage is checked while they are run
+        self.check_count += 1
+        if self.workspaces != None and self.check_count % BUDGET_INTERVAL == 0:
+            self.workspaces.check_budget()
+
+        self._store(key, names, result)
+        self._record(lines, result)
 
-        # Append lines to file
-        self.append_lines(lines)
+        # Return line number that failed, as well as the error message provided by meson
+        return result
+
+    def _store(self, key: str, names: List[str], result: Tuple[int, str], persistent: bool = True):
+        """Stores the result of a check for equivalent checks of this run and (if persistent) of later runs."""
+        # Crashes might not be caused by the checked lines, so they are not stored
+        if "<CRASH>" in result[1]:
+            return
+        # The generated names in the error message are replaced for equivalent checks
+        stored = result[0], canonicalize_names(result[1], names)
+        self.memo.put(key, stored)
+        if self.cache != None and persistent:
+            self.cache.put(key, stored)
+
+    def _record(self, lines: List[str], result: Tuple[int, str]):
+        """Records the result of a check (also a stored one) into the record table, if there is one."""
+        # Crashes and timeouts are not caused by the checked lines
+        if self.record_table == None or result[0] == TIMEOUT_LINE or "<CRASH>" in result[1]:
+            return
+        self.record_table.record(self.prelude(), list(lines), result)
+
+    def _timeout(self) -> Optional[float]:
+        """Returns how long the next check may run (None: unlimited). Raises a TimeoutError, if the global timeout has passed."""
+        if self.deadline == None:
+            return self.timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Global timeout exceeded, check was not run.")
+        return remaining if self.timeout == None else min(self.timeout, remaining)
+
+    def check_batch(self, snippets: List[List[str]], prefix: List[str] = []) -> List[Tuple[int, str]]:
+        """
+        Runs a check for each of the given independent snippets, each preceded by the prefix lines.
+        Returns error line and error message for each snippet (just like check_lines(prefix + snippet)).
+        """
+        # Warnings are always reported for the first line, so they can't be assigned to a snippet
+        # The stub backend answers single checks (batching doesn't save anything there)
+        if self.batch_size <= 1 or self.warnings or not self.backend.requires_meson:
+            return [ self.check_lines(prefix + snippet) for snippet in snippets ]
+
+        """
+        Only snippets without a stored result are batched. Of snippets that only differ in generated
+        names, only the first one is batched; the others are checked afterwards and get its stored result.
+        """
+        results = [ None ] * len(snippets)
+        pending = []
+        duplicates = []
+        keys = set()
+        for index, snippet in enumerate(snippets):
+            key, names = self.check_key(prefix + snippet)
+            results[index] = self._stored_result(key, names)
+            if results[index] != None:
+                continue
+            elif key in keys:
+                duplicates.append(index)
+            else:
+                keys.add(key)
+                pending.append(index)
+
+        for index, result in zip(pending, self._check_batch([ snippets[index] for index in pending ], prefix)):
+            results[index] = result
+        for index in duplicates:
+            results[index] = self.check_lines(prefix + snippets[index])
+        # Snippets of a batched meson run are recorded as single checks, so they can be replayed one by one
+        for snippet, result in zip(snippets, results):
+            self._record(prefix + snippet, result)
+        return results
+
+    def _check_batch(self, snippets: List[List[str]], prefix: List[str]) -> List[Tuple[int, str]]:
+        """Runs the checks of check_batch(), packing up to batch_size snippets into a single meson run."""
+        results = [ None ] * len(snippets)
+        start = 0
+        while start < len(snippets):
+            # Collect up to batch_size snippets, a terminating snippet is always checked on its own
+            group = []
+            for snippet in snippets[start:start + self.batch_size]:
+                if any(TERMINATING_CALL.search(line) for line in snippet):
+                    if len(group) == 0:
+                        group.append(snippet)
+                    break
+                group.append(snippet)
+
+            if len(group) == 1:
+                results[start] = self.check_lines(prefix + group[0])
+                start += 1
+                continue
 
-        # Check for errors
-        builddir = os.path.join(self.src_folder.name, "builddir")
-        result = subprocess.run(["meson", "--reconfigure"], cwd=builddir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Run all snippets of the group in a single meson run, the prefix is only added once
+            offsets = []
+            lines = list(prefix)
+            for snippet in group:
+                offsets.append(len(lines))
+                lines += snippet
+            error_line, error_msg = self.check_lines(lines)
+
+            # A timeout can't be assigned to a snippet, so each snippet of the group is checked on its own
+            if error_line == TIMEOUT_LINE:
+                for i, snippet in enumerate(group):
+                    results[start + i] = self.check_lines(prefix + snippet)
+                start += len(group)
+                continue
 
-        error_line = -1
-        error_msg = ""
-        for stdout_line in result.stdout.decode().split(os.linesep):
-            # Ignore error line
-            if IGNORE_STRING in stdout_line:
+            # No error -> every snippet was successful (the first one like in a single check)
+            if error_line < 0:
+                for i, snippet in enumerate(group):
+                    results[start + i] = self._store_snippet(prefix + snippet, (-1, ""), persistent=i == 0)
+                start += len(group)
                 continue
-            # Check if line is error
-            if re.match(r"\.\.[\\\/]meson\.build:\d+:\d+: ERROR: .*", stdout_line):
-                error_msg = stdout_line.split("ERROR:")[1].strip()
-                error_line = int(stdout_line.split(":")[1])
-                break
-            # Check if line is warning
-            elif "WARNING" in stdout_line and self.warnings:
-                error_msg = stdout_line.split("WARNING:")[1].strip() + yellow(" (WARNING)")
-                error_line = lines_before + 1
-                break
-            # If line contains ERROR -> regex might be out of date
-            elif "ERROR" in stdout_line:
-                if "ERROR: First statement must be a call to project" in stdout_line:
-                    print(f"{yellow('<INTERNAL>')} No project() call in meson.build file.")
-                    error_line = lines_before + 1
-                else:
-                    print(f"{yellow('<INTERNAL>')} ERROR line found, but regex didn't match. Did the formatting change?")
-
-        # 'meson --reconfigure' does not write to stderr, so if something was written, meson has crashed
-        if len(result.stderr) > 0 and not self.verbose:
-            error_msg = f"{red('<CRASH>')} Meson has crashed, re-run with --verbose to see stderr."
-            error_line = lines_before + 1 # arbitrary number, so that test won't be re-run
-
-        # If output is verbose, print stderr aswell
-        elif len(result.stderr) > 0 and self.verbose:
-            print(result.stderr.decode())
-            error_msg = f"{red('<CRASH>')} Meson has crashed."
-            error_line = lines_before + 1 # arbitrary number, so that test won't be re-run
-
-        # if output is verbose, print buildfile contents and stdout
-        if error_line >= 0 and self.verbose:
-            print("######## MESON.BUILD CONTENTS ########")
-            with open(self.buildfile, "r") as file:
-                print(file.read())
-            print("########## STDOUT CONTENTS ###########")
-            print(result.stdout.decode())
-
-
-        # Remove lines from file
-        self.pop_lines(len(lines))
-        
-        # Return line number that failed, as well as the error message provided by meson
-        return (error_line - lines_before - 1), error_msg
 
-    def __dest__(self):
+            # Find the snippet that contains the error line. All snippets before were successful.
+            failed = max([ i for i, offset in enumerate(offsets) if offset <= error_line ], default=0)
+            for i in range(failed):
+                results[start + i] = self._store_snippet(prefix + group[i], (-1, ""), persistent=i == 0)
+
+            """
+            The error might have been caused by an earlier snippet (e.g. by declaring a target
+            before add_project_arguments() is called), or is not related to a line at all (crash).
+            So the failing snippet is checked again on its own, unless it is the first snippet
+            of the group (meson has evaluated exactly the same lines as in a single check then).
+            The remaining snippets are batched again.
+            """
+            if failed == 0 and "<CRASH>" not in error_msg:
+                results[start] = self._store_snippet(prefix + group[0], (error_line, error_msg))
+            else:
+                results[start + failed] = self.check_lines(prefix + group[failed])
+            start += failed + 1
+
+        return results
+
+    def _store_snippet(self, lines: List[str], result: Tuple[int, str], persistent: bool = True) -> Tuple[int, str]:
+        """
+        Stores the result of a snippet of a batched meson run (like a single check of the lines), and returns it.
+        A snippet after other snippets only succeeded in their context (e.g. after meson.override_find_program()
+        or add_languages()), so its success is only stored for this run, not in the persistent cache.
+        """
+        key, names = self.check_key(lines)
+        self._store(key, names, result, persistent)
+        return result
+
+    def close(self):
+        """Stops the backend and removes the temporary folder (a persistent workspace is only released)."""
+        if getattr(self, "isolated_bf", None) != None:
+            self.isolated_bf.close()
+            self.isolated_bf = None
+        if getattr(self, "backend", None) != None:
+            self.backend.close()
+            self.backend = None
+        if getattr(self, "src_folder", None) != None:
+            self.src_folder.cleanup()
+            self.src_folder = None
+
+    def __del__(self):
         """Destructor, removes temporary folder."""
-        self.src_folder.cleanup()
\ No newline at end of file
+        self.close()
\ No newline at end of file
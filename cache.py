@@ -0,0 +1,125 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib, os, sqlite3, threading, time
+from typing import Optional, Tuple
+
+"""
+Persistent cache for check results. A result is stored under a hash of everything
+that influences it: the lines of the meson.build file (with generated names replaced by
+placeholders, see util.canonicalize()), the template files,
+the meson version and the toolchain (see BuildFile.fingerprint).
+The cache is a SQLite database, the least recently used results are evicted
+once the database exceeds its maximum size.
+"""
+
+def default_cache_path() -> str:
+    """Returns the default path of the cache database (inside of $XDG_CACHE_HOME or ~/.cache)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "meson-classification-checker", "results.sqlite")
+
+class ResultCache:
+    """Maps hashes of checks to their result (error line, error message)."""
+
+    # Size of a result without its message (key, line, timestamps)
+    ENTRY_OVERHEAD = 128
+
+    # The size of the database is checked after this many insertions
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str = None, max_size: int = 64 * 1024 * 1024, refresh: bool = False):
+        self.path = default_cache_path() if path == None else path
+        self.max_size = max_size # Maximum size in bytes
+        self.refresh = refresh # Don't read results, only store new ones
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Guards the connection (it is shared by all threads) and the number of insertions
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                    key TEXT PRIMARY KEY,
+                                    error_line INTEGER NOT NULL,
+                                    error_msg TEXT NOT NULL,
+                                    size INTEGER NOT NULL,
+                                    last_used REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.insertions = 0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        """Returns the key for a check, made up of the given parts."""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part.encode()
+            # Prefix each part with its length, so that parts can't be confused with each other
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[int, str]]:
+        """Returns the stored result for the key, or None."""
+        if self.refresh:
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT error_line, error_msg FROM results WHERE key = ?", (key,)).fetchone()
+            if row == None:
+                return None
+            self.connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            return (row[0], row[1])
+
+    def put(self, key: str, result: Tuple[int, str]):
+        """Stores the result for the key."""
+        error_line, error_msg = result
+        size = ResultCache.ENTRY_OVERHEAD + len(error_msg.encode())
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                    (key, error_line, error_msg, size, time.time()))
+            self.insertions += 1
+            if self.insertions % ResultCache.EVICTION_INTERVAL == 0:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used results, until the cache is smaller than its maximum size."""
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Evict down to 90% of the maximum size, so that eviction doesn't run on every insertion
+        excess = total - int(self.max_size * 0.9)
+        # Delete the oldest results, until the size of the deleted results exceeds the excess
+        self.connection.execute("""DELETE FROM results WHERE key IN (
+                                    SELECT key FROM (
+                                        SELECT key, SUM(size) OVER (ORDER BY last_used, key ROWS UNBOUNDED PRECEDING) - size AS before
+                                        FROM results)
+                                    WHERE before < ?)""", (excess,))
+
+    def close(self):
+        """Evicts results if required and closes the database."""
+        with self.lock:
+            self._evict()
+            self.connection.close()
+
+class ResultMemo:
+    """
+    Results of the checks of the current run (kept in memory, shared by all buildfiles). Together with
+    canonical keys (see BuildFile.check_key()), checks that only differ in generated names are run once.
+    """
+
+    def __init__(self):
+        self.results = {}
+        # Guards the results and the number of hits
+        self.lock = threading.Lock()
+        self.hits = 0 # Number of checks, that have not been run again
+
+    def get(self, key: str) -> Optional[Tuple[int, str]]:
+        """Returns the result for the key, or None."""
+        with self.lock:
+            result = self.results.get(key)
+            if result != None:
+                self.hits += 1
+            return result
+
+    def put(self, key: str, result: Tuple[int, str]):
+        """Stores the result for the key."""
+        with self.lock:
+            self.results[key] = result
\ No newline at end of file
@@ -0,0 +1,250 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import json, os, shutil, signal, subprocess, sys, tempfile, threading
+from typing import Tuple
+
+"""
+A fork server for running checks. The server is a long-lived python process that
+imports mesonbuild (and loads the coredata of each build directory) once.
+For every check it forks a child, which runs 'meson --reconfigure' just like
+the meson executable would. So every check still runs in its own process
+(a crash is still detected by output on stderr), but the startup of the
+python interpreter and the imports are only paid once.
+
+The server can also snapshot the interpreter: it interprets the common prelude of
+the meson.build file (see inprocess.SnapshotMeson) once, and each forked child
+only interprets the lines of the check.
+
+The server reads one JSON request per line from stdin and answers with one JSON line on stdout.
+"""
+
+def meson_python() -> str:
+    """Returns the python interpreter of the meson executable (which is able to import mesonbuild)."""
+    meson = shutil.which("meson")
+    if meson != None:
+        with open(meson, "rb") as file:
+            shebang = file.readline().decode(errors="ignore")
+        if shebang.startswith("#!"):
+            command = shebang[2:].split()
+            # '#!/usr/bin/env python3'
+            if len(command) > 1 and os.path.basename(command[0]) == "env":
+                return shutil.which(command[1]) or sys.executable
+            elif len(command) > 0 and os.path.exists(command[0]):
+                return command[0]
+    return sys.executable
+
+def kill_group(pid: int):
+    """Kills the process group led by the given process (including all processes it has started)."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def wait_exited(pid: int):
+    """Waits until the process has exited, without reaping it (so its pid and process group can't be reused yet)."""
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    except ChildProcessError:
+        pass
+
+class Watchdog:
+    """Kills the process group of a process, if it is still running after timeout seconds (None: never)."""
+
+    def __init__(self, pid: int, timeout: float = None):
+        self.expired = False
+        self.timer = None
+        if timeout != None:
+            self.timer = threading.Timer(timeout, self._expire, args=(pid,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _expire(self, pid: int):
+        self.expired = True
+        kill_group(pid)
+
+    def cancel(self):
+        """Stops the watchdog, once the process has terminated."""
+        if self.timer != None:
+            self.timer.cancel()
+            # Don't leave a thread behind (the fork server must not fork while other threads are running)
+            self.timer.join()
+
+class ForkServer:
+    """Client for a fork server process."""
+
+    def __init__(self):
+        self.process = subprocess.Popen([meson_python(), os.path.abspath(__file__)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        # The server reports whether mesonbuild could be imported
+        response = self._receive()
+        if "error" in response:
+            self.close()
+            raise RuntimeError(f"Could not start fork server: {response['error']}")
+
+    def _receive(self) -> dict:
+        line = self.process.stdout.readline()
+        if len(line) == 0:
+            raise RuntimeError("Fork server has terminated unexpectedly.")
+        return json.loads(line)
+
+    def _request(self, request: dict) -> dict:
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        response = self._receive()
+        if "timeout" in response:
+            raise TimeoutError(response["timeout"])
+        return response
+
+    def run(self, build_dir: str, timeout: float = None) -> Tuple[str, str]:
+        """
+        Runs 'meson --reconfigure' in a forked child. Returns stdout and stderr of the child.
+        Raises a TimeoutError, if the child has been killed after timeout seconds.
+        """
+        response = self._request({ "builddir" : build_dir, "timeout" : timeout })
+        return response["stdout"], response["stderr"]
+
+    def run_snapshot(self, src_dir: str, build_dir: str, prelude_lines: int, timeout: float = None) -> Tuple[int, str, str, str]:
+        """
+        Interprets the lines of the meson.build file after the first prelude_lines lines in a forked child
+        of the snapshot of the prelude. Returns the same values as InProcessMeson.run().
+        Raises a TimeoutError, if the child has been killed after timeout seconds.
+        """
+        response = self._request({ "srcdir" : src_dir, "builddir" : build_dir, "prelude" : prelude_lines, "timeout" : timeout })
+        return response["error_line"], response["error_msg"], response["log"], response["crash"]
+
+    def close(self):
+        """Stops the server process."""
+        if self.process.poll() == None:
+            self.process.stdin.close()
+            self.process.wait()
+
+def fork(child, timeout: float = None) -> Tuple[str, str, int]:
+    """
+    Runs child() in a forked process. Returns what the child has written to stdout and stderr, and its exit status.
+    Raises a TimeoutError, if the child (and every process it has started) has been killed after timeout seconds.
+    """
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            os.setpgid(0, 0)
+            os.dup2(stdout.fileno(), 1)
+            os.dup2(stderr.fileno(), 2)
+            code = 2
+            try:
+                code = child()
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        # Set the process group in the parent aswell, so that it exists before the watchdog might kill it
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+        watchdog = Watchdog(pid, timeout)
+        try:
+            wait_exited(pid)
+        except BaseException:
+            # The child has its own process group, so an interrupt of the server doesn't reach it
+            kill_group(pid)
+            raise
+        finally:
+            # The watchdog is stopped before the child is reaped, so it never kills a reaped process group
+            watchdog.cancel()
+            _, status = os.waitpid(pid, 0)
+        # The watchdog might fire just after the child has exited on its own
+        if watchdog.expired and os.WIFSIGNALED(status):
+            raise TimeoutError(f"Meson did not finish within {timeout:g} seconds.")
+
+        stdout.seek(0)
+        stderr.seek(0)
+        stdout_text = stdout.read().decode(errors="replace")
+        stderr_text = stderr.read().decode(errors="replace")
+        # A child that was killed by a signal didn't write a traceback, but it has crashed
+        if os.WIFSIGNALED(status) and len(stderr_text) == 0:
+            stderr_text = f"Meson was killed by signal {os.WTERMSIG(status)}."
+        return stdout_text, stderr_text, status
+
+def reconfigure(build_dir: str, timeout: float = None) -> dict:
+    """Runs 'meson --reconfigure' in a forked child, started in the build directory."""
+    from mesonbuild import mesonmain, mlog
+    meson = shutil.which("meson") or "meson"
+    def child():
+        # A snapshot might have disabled the log output
+        mlog.enable()
+        os.chdir(build_dir)
+        return mesonmain.run(["--reconfigure"], meson)
+    stdout, stderr, status = fork(child, timeout)
+    return { "stdout" : stdout, "stderr" : stderr }
+
+def snapshot_check(snapshots: dict, src_dir: str, build_dir: str, prelude_lines: int, timeout: float = None) -> dict:
+    """Interprets the lines after the prelude in a forked child of the snapshot of the prelude."""
+    from inprocess import SnapshotMeson
+    from mesonbuild.mesonlib import MesonException
+
+    with open(os.path.join(src_dir, "meson.build"), "r") as file:
+        lines = file.read().split("\n")
+    prelude = "".join(line + "\n" for line in lines[:prelude_lines])
+    code = "\n".join(lines[prelude_lines:])
+
+    # (Re-)create the snapshot if the prelude has changed
+    snapshot = snapshots.get((src_dir, build_dir))
+    if snapshot == None or snapshot.prelude != prelude:
+        try:
+            snapshot = SnapshotMeson(src_dir, build_dir, prelude)
+        except MesonException as e:
+            return { "error_line" : getattr(e, "lineno", -1), "error_msg" : str(e), "log" : "", "crash" : "" }
+        snapshots[(src_dir, build_dir)] = snapshot
+
+    def child():
+        print(json.dumps(dict(zip(("error_line", "error_msg", "log", "crash"), snapshot.run(code)))))
+        return 0
+    stdout, stderr, status = fork(child, timeout)
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        # The child has crashed before it could report a result
+        return { "error_line" : -1, "error_msg" : "", "log" : stdout, "crash" : stderr }
+
+def serve():
+    """Main loop of the fork server."""
+    try:
+        from mesonbuild import coredata
+    except ImportError as e:
+        print(json.dumps({ "error" : str(e) }), flush=True)
+        return
+    print(json.dumps({ "ready" : True }), flush=True)
+
+    loaded = set()
+    snapshots = {}
+    for request in sys.stdin:
+        request = json.loads(request)
+        build_dir = request["builddir"]
+
+        # Loading the coredata once imports everything it references (e.g. the compiler classes)
+        if build_dir not in loaded:
+            coredata.load(build_dir)
+            loaded.add(build_dir)
+
+        try:
+            if "prelude" in request:
+                response = snapshot_check(snapshots, request["srcdir"], build_dir, request["prelude"], request.get("timeout"))
+            else:
+                response = reconfigure(build_dir, request.get("timeout"))
+        except TimeoutError as e:
+            response = { "timeout" : str(e) }
+        print(json.dumps(response), flush=True)
+
+if __name__ == "__main__":
+    try:
+        serve()
+    # The server shares the terminal of the client, which handles the interrupt (a running child has been killed)
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
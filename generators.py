@@ -2,9 +2,9 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from typing import List, Union
-import templates, inspect
-from util import iskwarg, varname, get_parameter_combinations, ismultimethod, get_methods
+from typing import Dict, List, Optional, Tuple, Union
+import templates, inspect, itertools, functools
+from util import iskwarg, varname, get_parameter_combinations, ismultimethod, get_methods, get_objects, canonicalize, naming_scope, restore_names
 
 """
     The following generator are used to generate lines for different checks.
@@ -16,6 +16,51 @@ from util import iskwarg, varname, get_parameter_combinations, ismultimethod, ge
 magic_methods = { "__add__" : 1, "__sub__" : 1, "__mult__" : 1, "__div__" : 1,
                   "__mod__" : 1, "__getitem__" : 1, "__setitem__" : 2, "__contains__" : 1 }
 
+def _checkable_methods(T) -> Dict[str, object]:
+    """Returns the multimethods of a type, that can be called on any object of the type (by name)."""
+    methods = dict()
+    for name, mm in inspect.getmembers(T, predicate=ismultimethod):
+        # Methods that require a special object of the type can't be called on a returned object
+        special_templates = templates.special[mm] if mm in templates.special else None
+        if special_templates == None or templates.OBJECT not in special_templates:
+            methods[name] = mm
+    return methods
+
+@functools.lru_cache(maxsize=None)
+def discriminating_methods(T) -> Optional[List[str]]:
+    """
+    Returns the smallest set of methods of a type (by name), that tells it apart from its supertypes and
+    siblings (types with a common base, all types without a base are siblings): for each of these types
+    that can be told apart, one of the methods is missing. If an object has another of these types,
+    calling the methods fails. Returns None, if T is not a type of the objects module. The set is empty,
+    if no method tells T apart from any of these types.
+    """
+    types = get_objects()
+    if T not in types:
+        return None
+
+    bases = lambda U: { B for B in U.__bases__ if B in types }
+    supertypes = [ U for U in inspect.getmro(T)[1:] if U in types ]
+    siblings = [ U for U in types if U is not T and (bases(U) & bases(T) or len(bases(U)) == len(bases(T)) == 0) ]
+
+    # The types each method tells T apart from (methods that tell it apart from the same types are interchangeable)
+    candidates = dict()
+    for name, mm in _checkable_methods(T).items():
+        distinguished = frozenset(U for U in supertypes + siblings if not hasattr(U, name))
+        cost = min(len(inspect.signature(method).parameters) for method in get_methods(mm))
+        if len(distinguished) > 0 and (distinguished not in candidates or cost < candidates[distinguished][0]):
+            candidates[distinguished] = (cost, name)
+
+    # Try all sets of methods, from the smallest to the largest, and take the one with the fewest parameters
+    distinguishable = frozenset().union(*candidates)
+    for size in range(len(candidates) + 1):
+        covers = [ combination for combination in itertools.combinations(candidates, size)
+                    if frozenset().union(*combination) == distinguishable ]
+        if len(covers) > 0:
+            best = min(covers, key=lambda combination: (sum(candidates[types][0] for types in combination),
+                                                        sorted(candidates[types][1] for types in combination)))
+            return sorted(candidates[types][1] for types in best)
+
 class FunctionGenerator:
     """This class provides methods to generate lines for a function call"""
 
@@ -140,12 +185,42 @@ class MethodGenerator(FunctionGenerator):
 class ReturnTypeGenerator():
     """This class provides methods to generate lines for a returnvalue type check"""
 
-    def __init__(self, T, obj_name: str):
+    # Lines of the returnvalue type check of each type (and strategy for parameter combinations), with
+    # placeholders for the generated names (see util.canonicalize()), the number of names, and the
+    # index of the object's placeholder
+    bodies = dict()
+
+    def __init__(self, T, obj_name: str, combinations: str = "full", full: bool = True):
         self.T = T
         self.obj_name = obj_name
+        self.combinations = combinations # Strategy for choosing parameter combinations (see util.COMBINATIONS)
+        self.full = full # Call every method with every combination, instead of only the discriminating methods
 
     def generate_lines(self) -> List[str]:
         """Generates lines required for a returnvalue type check"""
+        # The lines of a type only differ in the object and the generated names, so they are only generated once
+        key = (self.T, self.combinations, self.full)
+        if key not in ReturnTypeGenerator.bodies:
+            ReturnTypeGenerator.bodies[key] = self._generate_body()
+        lines, count, obj_index = ReturnTypeGenerator.bodies[key]
+
+        names = [ self.obj_name if index == obj_index else varname() for index in range(count) ]
+        return [ restore_names(line, names) for line in lines ]
+
+    def _generate_body(self) -> Tuple[List[str], int, Optional[int]]:
+        """Generates the lines for an object with a generated name, and replaces all generated names with placeholders."""
+        with naming_scope(f"returncheck:{self.T!r}:{self.combinations}:{self.full}"):
+            obj_name = varname()
+            lines, names = canonicalize(self._generate_lines(obj_name))
+        return lines, len(names), names.index(obj_name) if obj_name in names else None
+
+    def _generate_lines(self, obj_name: str) -> List[str]:
+        """Generates the lines for the given object."""
+        discriminating = None if self.full else discriminating_methods(self.T)
+        # Without discriminating methods (e.g. all methods are inherited), every method is called
+        if discriminating:
+            return self._generate_discriminating_lines(obj_name, discriminating)
+
         lines = []
         # Iterate over methods
         for name, mm in inspect.getmembers(self.T, predicate=ismultimethod):
@@ -163,7 +238,19 @@ class ReturnTypeGenerator():
                 Since parameters can be optional, there are multiple combinations of parameters that
                 need to be tested.
                 """
-                for parameter_combination in get_parameter_combinations(method):
-                    check = MethodGenerator(name, self.obj_name, parameter_combination, special_templates_key=mm)
+                for parameter_combination in get_parameter_combinations(method, self.combinations):
+                    check = MethodGenerator(name, obj_name, parameter_combination, special_templates_key=mm)
                     lines += check.generate_lines(None)
         return lines
+
+    def _generate_discriminating_lines(self, obj_name: str, names: List[str]) -> List[str]:
+        """Generates a single call of each of the given methods (the one with the fewest parameters)."""
+        lines = []
+        methods = _checkable_methods(self.T)
+        for name in names:
+            mm = methods[name]
+            calls = [ parameter_combination for method in get_methods(mm)
+                        for parameter_combination in get_parameter_combinations(method, self.combinations) ]
+            parameter_combination = min(calls, key=len)
+            lines += MethodGenerator(name, obj_name, parameter_combination, special_templates_key=mm).generate_lines(None)
+        return lines
\ No newline at end of file
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import functools, inspect, io, json, os, sys, threading, typing
+import generators, templates, util
+from buildfile import file_digest
+from cache import ResultCache, default_cache_path
+from log import Log
+from typing import Callable
+
+"""
+Incremental checking. Every unit of checks (the checks of a function, of a method
+of a type or of the usages of a type) has a fingerprint, that covers everything the
+checks are generated from: the signatures and return annotations of the checked callables,
+their special templates and the templates of all parameter types.
+If the return value is checked, the methods of the return type are part of the
+fingerprint as well, and so are the methods that tell the return type apart from the
+other types (they depend on the methods of its supertypes and siblings). Usage checks try every function and method, so their
+fingerprint covers the whole classification.
+The output and the number of successes and failures of each unit are stored. A unit, whose
+fingerprint has not changed since the last run, is not checked again; its stored output is
+printed instead.
+"""
+
+# Modules of this tool, that influence how checks are generated and evaluated
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_FILES = [ "checkers.py", "generators.py", "plan.py", "util.py", "buildfile.py", "backends.py", "lattice.py" ]
+
+def default_state_path() -> str:
+    """Returns the default path of the stored state (next to the cache of check results)."""
+    return os.path.join(os.path.dirname(default_cache_path()), "incremental.json")
+
+def _types(T):
+    """Returns T and all types T is made of (e.g. the types in a Union)."""
+    yield T
+    for arg in typing.get_args(T):
+        yield from _types(arg)
+
+def _template(T) -> str:
+    try:
+        return repr(templates.templates.get(T))
+    except TypeError: # Not hashable
+        return "None"
+
+def _methods(clb):
+    return util.get_methods(clb) if util.ismultimethod(clb) else (clb,)
+
+def _return_type(method):
+    return util.get_type(inspect.signature(method).return_annotation)
+
+def _returncheck_required(return_type) -> bool:
+    return return_type not in (typing.Any, type(None))
+
+@functools.lru_cache(maxsize=None)
+def signature_fingerprint(clb) -> str:
+    """Returns the fingerprint of a callable: its signatures, its special templates and the templates of its parameters."""
+    parts = [ repr(templates.special.get(clb)) ]
+    param_types = set()
+    for method in _methods(clb):
+        parts.append(f"{method.__name__}{inspect.signature(method)}")
+        # Every variant of each parameter, instead of every combination of them
+        for param_choices in util.parameter_space(method).choices:
+            for param in param_choices:
+                for T in _types(param.annotation):
+                    param_types.add(f"{T!r}: {_template(T)}")
+    return ResultCache.key(*parts, *sorted(param_types))
+
+@functools.lru_cache(maxsize=None)
+def type_fingerprint(T) -> str:
+    """Returns the fingerprint of a type: its template, the fingerprints of all of its methods and its discriminating methods."""
+    return ResultCache.key(_template(T), repr(generators.discriminating_methods(T)),
+                           *[ signature_fingerprint(mm) for name, mm in inspect.getmembers(T, predicate=util.ismultimethod) ])
+
+@functools.lru_cache(maxsize=None)
+def classification_fingerprint() -> str:
+    """Returns the fingerprint of the whole classification (all functions, types and templates)."""
+    return ResultCache.key(*[ signature_fingerprint(func) for func in util.get_functions() ],
+                           *[ type_fingerprint(T) for T in util.get_objects() ])
+
+def callable_fingerprint(clb, T=None, check_return_usages: bool = False) -> str:
+    """Returns the fingerprint of the checks of a function, or of a method of the type T."""
+    parts = [ signature_fingerprint(clb) ]
+    # The object for a method is created from the template of its type
+    if T != None:
+        parts.append(_template(T))
+    for method in _methods(clb):
+        return_type = _return_type(method)
+        if _returncheck_required(return_type):
+            parts.append(type_fingerprint(return_type))
+            if check_return_usages:
+                parts.append(classification_fingerprint())
+    return ResultCache.key(*parts)
+
+def usage_fingerprint(T) -> str:
+    """Returns the fingerprint of the usage checks of the type T."""
+    return ResultCache.key(_template(T), classification_fingerprint())
+
+class IncrementalState:
+    """Stores the fingerprint, the output and the results of every unit of checks."""
+
+    def __init__(self, options: str, path: str = None):
+        self.path = default_state_path() if path == None else path
+        # Results are only valid for the same options, meson version and tool version
+        self.options = ResultCache.key(options, *[ file_digest(os.path.join(SOURCE_DIR, file)) for file in SOURCE_FILES ])
+        self.units = {}
+        # Guards the units, which are stored by the jobs of all workers
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.path, "r") as file:
+                state = json.load(file)
+            if state.get("options") == self.options:
+                self.units = state["units"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def is_current(self, key: str, fingerprint: str) -> bool:
+        """Returns whether stored results exist for the unit and its fingerprint is unchanged."""
+        with self.lock:
+            unit = self.units.get(key)
+        return unit != None and unit["fingerprint"] == fingerprint
+
+    def run(self, key: str, fingerprint: str, checks: Callable[[], None]):
+        """
+        Runs the checks of a unit and stores their output and results.
+        If the fingerprint of the unit is unchanged, the stored output is printed instead.
+        """
+        if self.is_current(key, fingerprint):
+            with self.lock:
+                unit = self.units[key]
+            sys.stdout.write(unit["output"])
+            Log.add(unit["successful"], unit["failures"])
+            return
+
+        # sys.stdout is replaced by the CheckPool (see scheduler.ThreadLocalStdout)
+        output = io.StringIO()
+        sys.stdout.record(output)
+        counts = Log.record()
+        try:
+            checks()
+        finally:
+            sys.stdout.stop_recording(output)
+            Log.stop_recording(counts)
+
+        # Only store results of units that have been run completely (a timeout might not occur in the next run)
+        if counts[2] > 0:
+            return
+        with self.lock:
+            self.units[key] = { "fingerprint" : fingerprint, "output" : output.getvalue(),
+                                "successful" : counts[0], "failures" : counts[1] }
+
+    def save(self):
+        """Writes the stored results to disk."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            state = { "options" : self.options, "units" : self.units }
+        tmp_path = f"{self.path}.{os.getpid()}"
+        with open(tmp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(tmp_path, self.path)
\ No newline at end of file
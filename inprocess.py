@@ -0,0 +1,133 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import argparse, io, os, threading, traceback
+from typing import Tuple
+
+"""
+Runs the meson interpreter inside of this python process, instead of starting
+'meson --reconfigure' for every check. mesonbuild is only imported once, and errors
+are taken from the raised exception instead of parsing meson's output.
+The interpreter uses global state (e.g. the logger), so only one check can be
+run at a time.
+The SnapshotMeson variant is used by the fork server (see forkserver.py): it
+interprets the common prelude once and is then forked for every check.
+"""
+
+class InProcessMeson:
+    """Runs the meson interpreter on the meson.build file of a configured source directory."""
+
+    # mesonbuild is not thread-safe, so all interpreters share a single lock
+    lock = threading.Lock()
+
+    def __init__(self, src_dir: str, build_dir: str):
+        try:
+            from mesonbuild import build, coredata, environment, interpreter, interpreterbase, mesonlib, mlog, msetup
+        except ImportError:
+            raise RuntimeError("The in-process backend requires the mesonbuild module (python3 -m pip install meson).")
+
+        self.build = build
+        self.coredata = coredata
+        self.environment = environment
+        self.interpreter = interpreter
+        self.interpreterbase = interpreterbase
+        self.mesonlib = mesonlib
+        self.mlog = mlog
+
+        self.src_dir = src_dir
+        self.build_dir = build_dir
+        self.buildfile = os.path.join(src_dir, "meson.build")
+
+        # Same options as 'meson --reconfigure'
+        self.parser = argparse.ArgumentParser()
+        msetup.add_arguments(self.parser)
+
+    def _reset(self):
+        """Resets global state of mesonbuild, that would otherwise be carried over to the next check."""
+        self.mlog.log_file = io.StringIO()
+        self.mlog.disable()
+        getattr(self.mlog, "_logged_once", set()).clear()
+        self.mesonlib.project_meson_versions.clear()
+        for feature_check in (self.interpreterbase.FeatureNew, self.interpreterbase.FeatureDeprecated):
+            feature_check.feature_registry.clear()
+
+    def _environment(self):
+        """Loads the environment of the build directory, just like 'meson --reconfigure' does."""
+        options = self.parser.parse_args(["--reconfigure", self.build_dir, self.src_dir])
+        self.coredata.parse_cmd_line_options(options)
+        return self.environment.Environment(self.src_dir, self.build_dir, options)
+
+    def _error(self, e) -> Tuple[int, str]:
+        """Returns error line and error message of a meson exception."""
+        self.mlog.log(f"ERROR: {e}")
+        # Only errors in the meson.build file itself have a line (like the regex of the subprocess backend)
+        if getattr(e, "lineno", None) != None and os.path.abspath(getattr(e, "file", "")) == self.buildfile:
+            return e.lineno, str(e)
+        return -1, str(e)
+
+    def run(self) -> Tuple[int, str, str, str]:
+        """
+        Runs the interpreter. Returns the line of the first error (-1 if none or not in meson.build) and the error message,
+        as well as the log (what meson would have written to stdout) and a traceback if meson has crashed.
+        """
+        with InProcessMeson.lock:
+            self._reset()
+            error_line = -1
+            error_msg = ""
+            crash = ""
+            try:
+                intr = self.interpreter.Interpreter(self.build.Build(self._environment()))
+                intr.run()
+            except self.mesonlib.MesonException as e:
+                error_line, error_msg = self._error(e)
+            except Exception:
+                crash = traceback.format_exc()
+            return error_line, error_msg, self.mlog.log_file.getvalue(), crash
+
+class SnapshotMeson(InProcessMeson):
+    """
+    Interprets the first lines of the meson.build file (the prelude, containing the project() call) once.
+    Afterwards, only the remaining lines have to be interpreted for each check.
+    Interpreting lines changes the state of the interpreter, so run() must be called in a forked process.
+    """
+
+    def __init__(self, src_dir: str, build_dir: str, prelude: str):
+        super().__init__(src_dir, build_dir)
+        from mesonbuild import mparser
+        self.mparser = mparser
+        self.prelude = prelude
+        self.prelude_lines = prelude.count("\n")
+
+        # Interpret the prelude (raises a MesonException on error)
+        self._reset()
+        buildfile = self.buildfile
+        class PreludeInterpreter(self.interpreter.Interpreter):
+            def load_root_meson_file(self):
+                self.ast = mparser.Parser(prelude, buildfile).parse()
+        self.intr = PreludeInterpreter(self.build.Build(self._environment()))
+        self.intr.evaluate_codeblock(self.intr.ast, start=1)
+        self.prelude_log = self.mlog.log_file.getvalue()
+
+    def run(self, code: str) -> Tuple[int, str, str, str]:
+        """Interprets the given code, which follows the prelude. Returns the same values as InProcessMeson.run()."""
+        self.mlog.log_file = io.StringIO(self.prelude_log)
+        self.mlog.log_file.seek(0, io.SEEK_END)
+        error_line = -1
+        error_msg = ""
+        crash = ""
+        try:
+            # Pad the code with the prelude lines, so that line numbers match the meson.build file
+            try:
+                ast = self.mparser.Parser("\n" * self.prelude_lines + code, self.buildfile).parse()
+            except self.mesonlib.MesonException as e:
+                e.file = self.buildfile
+                raise e
+            self.intr.evaluate_codeblock(ast)
+        except self.interpreterbase.SubdirDoneRequest:
+            pass
+        except self.mesonlib.MesonException as e:
+            error_line, error_msg = self._error(e)
+        except Exception:
+            crash = traceback.format_exc()
+        return error_line, error_msg, self.mlog.log_file.getvalue(), crash
\ No newline at end of file
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import functools, inspect, typing, objects, util
+from typing import FrozenSet, Iterable, List
+
+"""
+Compatibility of all types of the classification, computed once per run:
+every type of the objects module and every type used in an annotation of a function
+or method (including the types of Unions and Arrays) gets an integer id, and for every
+type a bit set stores the annotations accepting an object of the type. Questions about
+several types (e.g. all annotations accepting any subclass of Target) combine their bit sets.
+The consumers of types are found by looking up the annotations of their parameters in the result.
+Some pairs can't be compared by util.is_subclass() (e.g. a Union containing Any, or an Array
+of a Union). They are decided by their structure instead (see decide()).
+"""
+
+def accepts(annotation, T) -> bool:
+    """Returns whether a parameter with the annotation accepts an object of type T."""
+    # if T is subclass of annotation type or type is generic and T in generic type list
+    return (
+        util.in_generic_types(annotation, T)
+        or (
+            # issubclass cannot be used with generic types
+            typing.get_origin(annotation) not in (objects.Array, typing.Union)
+            and typing.get_origin(T) not in (objects.Array, typing.Union)
+            and util.is_subclass(T, annotation)
+        )
+    )
+
+def decide(annotation, T) -> bool:
+    """
+    Returns whether a parameter with the annotation accepts an object of type T, like accepts(), but also for pairs
+    that util.is_subclass() can't compare: a Union is accepted, if each of its types is accepted; Any accepts every type;
+    a Union annotation accepts the types that one of its types accepts; an Array accepts the Arrays of accepted types.
+    """
+    try:
+        return accepts(annotation, T)
+    except TypeError:
+        pass
+    if util.isunion(T):
+        return all(decide(annotation, U) for U in typing.get_args(T))
+    if annotation == typing.Any:
+        return True
+    if util.isunion(annotation):
+        return any(decide(A, T) for A in typing.get_args(annotation))
+    if util.isarray(annotation) and util.isarray(T):
+        return all(any(decide(A, U) for A in typing.get_args(annotation)) for U in typing.get_args(T))
+    return False
+
+def classification_types() -> List:
+    """Returns every type of the objects module, and every type used in the annotations of functions and methods."""
+    types = dict() # Ordered set
+    def add(T):
+        T = util.get_type(T)
+        if T in types:
+            return
+        types[T] = None
+        for arg in typing.get_args(T):
+            add(arg)
+
+    for T in util.get_objects():
+        add(T)
+    callables = util.get_functions() + [ mm for T in util.get_objects() for name, mm in inspect.getmembers(T, predicate=util.ismultimethod) ]
+    for clb in callables:
+        for method in (util.get_methods(clb) if util.ismultimethod(clb) else (clb,)):
+            signature = inspect.signature(method)
+            for param in signature.parameters.values():
+                add(param.annotation)
+            add(signature.return_annotation)
+    return list(types)
+
+class TypeLattice:
+    """Bit sets of the annotations (by id), that accept an object of a type, for every type."""
+
+    def __init__(self, types: List):
+        self.types = types
+        self.ids = { T : i for i, T in enumerate(types) }
+        self.columns = [ self._column(T) for T in types ]
+
+    def _column(self, T) -> int:
+        return sum(1 << a for a, annotation in enumerate(self.types) if decide(annotation, T))
+
+    def accepting(self, T) -> FrozenSet:
+        """Returns the annotations accepting an object of type T."""
+        return self.accepting_any([T])
+
+    def accepting_any(self, types: Iterable) -> FrozenSet:
+        """Returns the annotations accepting an object of any of the types."""
+        # Types outside of the classification are decided on every call
+        columns = [ self.columns[self.ids[T]] if T in self.ids else self._column(T) for T in types ]
+        return frozenset(self.types[a] for a in _bits(functools.reduce(int.__or__, columns, 0)))
+
+@functools.lru_cache(maxsize=None)
+def classification_lattice() -> TypeLattice:
+    """Returns the lattice of all types of the classification."""
+    return TypeLattice(classification_types())
+
+def _bits(bitset: int) -> List[int]:
+    """Returns the indices of the set bits."""
+    indices = []
+    while bitset:
+        lowest = bitset & -bitset
+        indices.append(lowest.bit_length() - 1)
+        bitset ^= lowest
+    return indices
\ No newline at end of file
@@ -2,26 +2,66 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-from typing import Union
+from typing import List, Union
+import threading
 
 
 class Log:
-    """Keeps track of successful and failed tests"""
+    """Keeps track of successful, failed and timed out tests"""
 
     successful = 0
     failures   = 0
+    timeouts   = 0
+
+    # Guards the counters (see scheduler.CheckPool)
+    lock = threading.Lock()
+
+    # Counters of the current thread, while it is recording (see record())
+    local = threading.local()
 
     @staticmethod
     def success():
         """Increment success counter"""
-        Log.successful += 1
+        Log.add(1, 0)
 
     @staticmethod
     def failure():
         """Increment failure counter"""
-        Log.failures += 1
+        Log.add(0, 1)
+
+    @staticmethod
+    def timeout():
+        """Increment timeout counter"""
+        Log.add(0, 0, 1)
+
+    @staticmethod
+    def add(successful: int, failures: int, timeouts: int = 0):
+        """Increment all counters"""
+        with Log.lock:
+            Log.successful += successful
+            Log.failures += failures
+            Log.timeouts += timeouts
+        for recording in getattr(Log.local, "recordings", []):
+            recording[0] += successful
+            recording[1] += failures
+            recording[2] += timeouts
+
+    @staticmethod
+    def record() -> List[int]:
+        """Starts counting the results of the current thread. Returns the counters [successes, failures, timeouts]."""
+        if not hasattr(Log.local, "recordings"):
+            Log.local.recordings = []
+        recording = [0, 0, 0]
+        Log.local.recordings.append(recording)
+        return recording
+
+    @staticmethod
+    def stop_recording(recording: List[int]):
+        """Stops counting the results of the current thread."""
+        Log.local.recordings.remove(recording)
 
     @staticmethod
-    def result() -> Union[int, int]:
-        """Returns the tuple (successes, failures)"""
-        return (Log.successful, Log.failures)
\ No newline at end of file
+    def result() -> Union[int, int, int]:
+        """Returns the tuple (successes, failures, timeouts)"""
+        with Log.lock:
+            return (Log.successful, Log.failures, Log.timeouts)
\ No newline at end of file
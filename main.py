@@ -6,10 +6,16 @@
 
 from log import Log
 from templates import TemplateNotFoundException
-import objects, functions, os, argparse, inspect, sys, util
-from buildfile import BuildFile
+import objects, functions, os, argparse, inspect, sys, time, util
+from buildfile import BuildFile, file_digest
 from shutil import copyfile
 from checkers import FunctionChecker, TypeChecker
+from plan import FunctionPlan, Plan, Planner, TypePlan
+from scheduler import CheckPool
+from cache import ResultCache, ResultMemo
+from backends import StubTable
+from incremental import IncrementalState
+from workspace import MEMORY_DIR, WorkspaceManager
 from util import yellow, get_functions, get_objects
 
 # argparser
@@ -28,64 +34,212 @@ parser.add_argument("--only-function-name", dest="only_func_name", const=False,
                     help="Only displays the function (or method) name in a check, without the parameter types.")
 parser.add_argument("--summarize", const=True, default=False, nargs="?",
                     help="Print a summary (how many failures, how many successes)." )
+parser.add_argument("--jobs", "-j", dest="jobs", type=int, default=1,
+                    help="Number of checks that are run in parallel, each in its own build directory.")
+parser.add_argument("--batch-size", dest="batch_size", type=int, default=1,
+                    help="Maximum number of independent checks that are packed into a single meson run.")
+parser.add_argument("--backend", dest="backend", choices=["subprocess", "forkserver", "snapshot", "inprocess", "stub"], default="subprocess",
+                    help="How checks are run: 'meson --reconfigure' for each check, a fork of a process that has already imported meson, a fork of an interpreter that has already interpreted the project() call, the meson interpreter inside this process (requires the mesonbuild module), or without meson from the rules and recorded results of --stub-file.")
+parser.add_argument("--stub-file", dest="stub_file", default=None,
+                    help="JSON file with the rules and recorded results, that the stub backend answers checks from.")
+parser.add_argument("--record-stub", dest="record_stub", default=None,
+                    help="Record the results of all checks into this JSON file, so that they can be replayed by the stub backend.")
+parser.add_argument("--no-cache", dest="no_cache", const=True, default=False, nargs="?",
+                    help="Don't use the persistent cache of check results.")
+parser.add_argument("--refresh-cache", dest="refresh_cache", const=True, default=False, nargs="?",
+                    help="Run every check again and replace the results in the persistent cache.")
+parser.add_argument("--cache-size", dest="cache_size", type=int, default=64,
+                    help="Maximum size of the persistent cache of check results in MiB.")
+parser.add_argument("--timeout", dest="timeout", type=float, default=None,
+                    help="Kill a check (and every process it has started) after this many seconds and report it as TIMEOUT (not supported by the inprocess backend).")
+parser.add_argument("--global-timeout", dest="global_timeout", type=float, default=None,
+                    help="Stop running checks after this many seconds, remaining checks are reported as TIMEOUT.")
+parser.add_argument("--tmpfs", dest="tmpfs", const=MEMORY_DIR, default=None, nargs="?",
+                    help=f"Create the directories for checks on a memory-backed file system (default: {MEMORY_DIR}).")
+parser.add_argument("--disk-budget", dest="disk_budget", type=int, default=1024,
+                    help="Maximum disk usage of the temporary directories for checks in MiB.")
+parser.add_argument("--workspace", dest="workspace", default=None,
+                    help="Keep the configured directories for checks in this directory and reuse them in the next run (skips 'meson setup' as long as meson and the project languages are unchanged).")
+parser.add_argument("--incremental", dest="incremental", const=True, default=False, nargs="?",
+                    help="Only check functions, methods and usages whose signatures or templates have changed since the last run, and report the stored results of everything else.")
+parser.add_argument("--seed", dest="seed", type=int, const=0, default=None, nargs="?",
+                    help="Generate variable and target names deterministically from this seed (default: 0), so that the same check always produces the same meson.build file.")
+parser.add_argument("--combinations", dest="combinations", choices=util.COMBINATIONS, default="full",
+                    help="Which combinations of parameter types are checked: all of them, every pair of types of two parameters (pairwise), or every type of each parameter (single). Fewer checks, but errors that only occur for a specific combination of three or more parameters can be missed.")
+parser.add_argument("--full-returntype-check", dest="full_returntype_check", const=True, default=False, nargs="?",
+                    help="Check a return value by calling every method of its type with every combination of parameters (instead of only the fewest methods, that tell the type apart from its supertypes and siblings).")
+parser.add_argument("--plan-only", dest="plan_only", const=True, default=False, nargs="?",
+                    help="Only print how many checks would be run for each function and method (and in total), without running them.")
+parser.add_argument("--save-plan", dest="save_plan", default=None,
+                    help="Write the planned checks to this JSON file.")
+parser.add_argument("--plan", dest="plan", default=None,
+                    help="Run the checks of a plan written by --save-plan (instead of planning the checks of the selected functions and types).")
 args = parser.parse_args()
 
 TEMPLATE_FILES_FOLDER = os.path.join(os.getcwd(), "template_files")
 
-# main()
-if __name__ == "__main__":
-    try:
-        bf = BuildFile(project_languages=["c", "java"],verbose=args.verbose, warnings=args.warnings)
-    except RuntimeError as e:
-        print(f"{yellow('INTERNAL')}:: {e}")
-        sys.exit()
-
+def setup_buildfile(template: BuildFile = None) -> BuildFile:
+    """Creates a buildfile (cloned from template, if given) and adds the template files to its source directory."""
+    bf = BuildFile(project_languages=["c", "java"],verbose=args.verbose, warnings=args.warnings, batch_size=args.batch_size,
+                    backend=args.backend, cache=cache, memo=memo, timeout=args.timeout, deadline=deadline,
+                    workspaces=workspaces, workspace=args.workspace, stub_table=stub_table, record_table=record_table,
+                    template=template)
     bf.append_line() # Padding
 
     # Add template files to buildfile source dir
     for template_file in os.listdir(TEMPLATE_FILES_FOLDER):
         path = os.path.join(TEMPLATE_FILES_FOLDER, template_file)
         bf.add_file(template_file, path)
-    
-    funcs = get_functions()
-    types = get_objects()
-
-    explicit = args.explicit
-    if explicit != None and len(explicit) != 0:
-        funcs = [ f for f in funcs if util.get_name(f) in explicit ]
-        types = [ t for t in types if util.get_name(t) in explicit ]
-        if len(funcs) == 0 and len(types) == 0:
-            print(f"No function or type found for the given name(s): '{explicit}'")
-
-    # Run TypeChecker for each type
-    for T in types:
+    return bf
+
+def type_check(plan: TypePlan):
+    """Returns a job, that runs the TypeChecker for the planned checks of a type."""
+    def job(bf: BuildFile):
         try:
-            checker = TypeChecker(T, bf,
-                        check_type_usages=args.type_usages,
-                        check_return_usages=args.return_usages,
-                        only_func_name=args.only_func_name)
+            checker = TypeChecker(plan, bf,
+                        only_func_name=args.only_func_name,
+                        incremental=incremental)
             checker.run()
         except TemplateNotFoundException as e:
             print(f"{yellow('INTERNAL')}:: {e}")
-        except KeyboardInterrupt as e:
-            print(f"{yellow('INTERNAL')}:: KeyboardInterrupt {' '*10}")
-            break
+    return job
 
-    # Run FunctionChecker for each function
-    for func in funcs:
+def function_check(plan: FunctionPlan):
+    """Returns a job, that runs the FunctionChecker for the planned checks of a function."""
+    def job(bf: BuildFile):
         try:
-            checker = FunctionChecker(func, bf,
-                        check_return_usages=args.return_usages,
-                        only_func_name=args.only_func_name)
+            checker = FunctionChecker(plan, bf,
+                        only_func_name=args.only_func_name,
+                        incremental=incremental)
             checker.run()
         except TemplateNotFoundException as e:
             print(f"{yellow('INTERNAL')}:: {e}")
-        except KeyboardInterrupt as e:
-            print(f"{yellow('INTERNAL')}:: KeyboardInterrupt {' '*10}")
-            break
+    return job
+
+# main()
+if __name__ == "__main__":
+    if args.jobs < 1:
+        print(f"{yellow('INTERNAL')}:: --jobs must be at least 1 (not {args.jobs}).")
+        sys.exit()
+
+    for name, timeout in (("--timeout", args.timeout), ("--global-timeout", args.global_timeout)):
+        if timeout != None and timeout <= 0:
+            print(f"{yellow('INTERNAL')}:: {name} must be positive (not {timeout}).")
+            sys.exit()
+
+    if args.disk_budget <= 0:
+        print(f"{yellow('INTERNAL')}:: --disk-budget must be positive (not {args.disk_budget}).")
+        sys.exit()
+
+    if args.tmpfs != None and not os.path.isdir(args.tmpfs):
+        print(f"{yellow('INTERNAL')}:: --tmpfs: '{args.tmpfs}' is not a directory.")
+        sys.exit()
+    if args.tmpfs != None and args.workspace != None:
+        print(f"{yellow('INTERNAL')}:: --tmpfs and --workspace can't be combined (put the workspace on a tmpfs instead).")
+        sys.exit()
+
+    if args.stub_file != None and not os.path.isfile(args.stub_file):
+        print(f"{yellow('INTERNAL')}:: --stub-file: '{args.stub_file}' is not a file.")
+        sys.exit()
+    if args.record_stub != None and args.backend == "stub":
+        print(f"{yellow('INTERNAL')}:: --record-stub requires a backend that runs meson.")
+        sys.exit()
+
+    if args.plan != None and args.incremental:
+        print(f"{yellow('INTERNAL')}:: --plan and --incremental can't be combined (the plan would not match the stored results).")
+        sys.exit()
+
+    # Remove directories of earlier runs, that could not clean up (e.g. because they were killed)
+    workspaces = WorkspaceManager(root=args.tmpfs, budget=args.disk_budget * 1024 * 1024)
+    workspaces.sweep()
+
+    deadline = None if args.global_timeout == None else time.monotonic() + args.global_timeout
+    # Results of the stub backend are not real results, so they are not cached
+    cache = None if args.no_cache or args.backend == "stub" else ResultCache(max_size=args.cache_size * 1024 * 1024, refresh=args.refresh_cache)
+    # Checks that only differ in generated names are only run once
+    memo = ResultMemo()
+    stub_table = StubTable(args.stub_file)
+    record_table = None if args.record_stub == None else StubTable(args.record_stub)
+
+    try:
+        # 'meson setup' is only run for the first buildfile, the others are cloned
+        # Planning only requires a buildfile for the options of the incremental state
+        buildfiles = []
+        if not args.plan_only or args.incremental:
+            buildfiles.append(setup_buildfile())
+        if not args.plan_only:
+            buildfiles += [ setup_buildfile(template=buildfiles[0]) for i in range(args.jobs - 1) ]
+    except RuntimeError as e:
+        print(f"{yellow('INTERNAL')}:: {e}")
+        sys.exit()
+
+    # Stored results are only valid for the same meson version, template files and options
+    incremental = None
+    if args.incremental:
+        options = [ buildfiles[0].fingerprint, args.warnings, args.verbose, args.only_func_name, args.type_usages, args.return_usages ]
+        if args.stub_file != None:
+            options.append(file_digest(args.stub_file))
+        if args.combinations != "full":
+            options.append(args.combinations)
+        if args.full_returntype_check:
+            options.append("full-returntype-check")
+        incremental = IncrementalState(" ".join(map(str, options)))
+    
+    if args.plan != None:
+        try:
+            plan = Plan.load(args.plan)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"{yellow('INTERNAL')}:: --plan: could not read '{args.plan}' ({type(e).__name__}: {e}).")
+            sys.exit()
+    else:
+        funcs = get_functions()
+        types = get_objects()
+
+        explicit = args.explicit
+        if explicit != None and len(explicit) != 0:
+            funcs = [ f for f in funcs if util.get_name(f) in explicit ]
+            types = [ t for t in types if util.get_name(t) in explicit ]
+            if len(funcs) == 0 and len(types) == 0:
+                print(f"No function or type found for the given name(s): '{explicit}'")
+
+        # Generate all checks before running any of them
+        util.set_seed(args.seed)
+        planner = Planner(check_type_usages=args.type_usages, check_return_usages=args.return_usages,
+                            combinations=args.combinations, full_returntype_check=args.full_returntype_check,
+                            incremental=incremental)
+        plan = planner.plan(types, funcs)
+        if not args.plan_only:
+            plan.print_reduction()
+
+    if args.save_plan != None:
+        plan.save(args.save_plan)
+
+    if args.plan_only:
+        plan.print_summary()
+    else:
+        pool = CheckPool(buildfiles)
+
+        # Run TypeChecker for each type
+        completed = pool.run([ type_check(type_plan) for type_plan in plan.types ])
+
+        # Run FunctionChecker for each function (unless the run was interrupted)
+        if completed:
+            completed = pool.run([ function_check(function_plan) for function_plan in plan.functions ])
+
+        # Only store the results of a complete run
+        if incremental != None and completed:
+            incremental.save()
 
-    if args.summarize:
-        successful, failures = Log.result()
-        print(f"Out of {successful + failures} total checks, {successful} were successful and {failures} were failures.")
+        if args.summarize:
+            successful, failures, timeouts = Log.result()
+            if timeouts == 0:
+                print(f"Out of {successful + failures} total checks, {successful} were successful and {failures} were failures.")
+            else:
+                print(f"Out of {successful + failures + timeouts} total checks, {successful} were successful, {failures} were failures and {timeouts} timed out.")
 
-    del bf
+    for bf in buildfiles:
+        bf.close()
+    if record_table != None:
+        record_table.save()
+    if cache != None:
+        cache.close()
\ No newline at end of file
@@ -0,0 +1,511 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+import inspect, json, objects, templates, typing, util
+from multimethod import multimethod
+from typing import List, Optional, Tuple
+from templates import TemplateNotFoundException
+from generators import FunctionGenerator, MethodGenerator, ReturnTypeGenerator
+from lattice import classification_lattice
+from incremental import IncrementalState, callable_fingerprint, usage_fingerprint
+from util import canonicalize, count_parameter_combinations, get_methods, get_parameter_combinations, get_type, ismultimethod, naming_scope, pretty_print_func, varname
+
+"""
+Before any check is run, the selected types and functions are turned into a plan:
+an explicit list of every check (the callable, its parameter combination, the object
+it is called on, the lines of the return type check and the usage checks of the
+return value). The checkers (see checkers.py) only run the checks of a plan and
+report their results, so the cost of a run is known before it starts (see --plan-only).
+A plan can be written to a JSON file and run separately (see --save-plan and --plan).
+
+If no template is found while planning, the error is stored in the plan and raised
+when the checks are run, at the point where it would have been raised before.
+"""
+
+# Dont do usage checks with these Types (because they are EVERYWHERE, and there are no problems)
+default_types = [ objects.Boolean, objects.String, objects.Number, objects.Array, typing.Dict ]
+
+# Version of the file format of a plan
+PLAN_VERSION = 1
+
+def _checks(n: int) -> str:
+    return "1 check" if n == 1 else f"{n} checks"
+
+class Check:
+    """A single check (one meson run, unless checks are batched) and everything required to report its result."""
+
+    def __init__(self, name: str, signature: str, call_lines: List[str],
+                    receiver: str = None,
+                    returncheck_lines: List[str] = [],
+                    return_var: str = None,
+                    usages: UsagePlan = None):
+        self.name = name # Name of the checked callable
+        self.signature = signature # Name and parameter types of the checked callable (see util.pretty_print_func)
+        self.call_lines = call_lines # Lines creating the arguments and calling the callable
+        self.receiver = receiver # Template of the object a method is called on
+        self.returncheck_lines = returncheck_lines # Lines checking the methods of the return value
+        self.return_var = return_var # Variable the return value is assigned to
+        self.usages = usages # Usage checks of the return value (only run if the invocation succeeds)
+
+    def lines(self) -> List[str]:
+        """Returns the lines of the invocation (without the return type check)."""
+        return self.call_lines if self.receiver == None else [f"obj = {self.receiver}"] + self.call_lines
+
+    def count(self) -> int:
+        """Returns the number of checks, including all usage checks of the return value."""
+        return 1 + (0 if self.usages == None else self.usages.count())
+
+    def to_dict(self) -> dict:
+        return { "name" : self.name, "signature" : self.signature, "call_lines" : self.call_lines, "receiver" : self.receiver,
+                 "returncheck_lines" : self.returncheck_lines, "return_var" : self.return_var,
+                 "usages" : None if self.usages == None else self.usages.to_dict() }
+
+    @staticmethod
+    def from_dict(data: dict) -> Check:
+        usages = None if data["usages"] == None else UsagePlan.from_dict(data["usages"])
+        return Check(data["name"], data["signature"], data["call_lines"], data["receiver"],
+                        data["returncheck_lines"], data["return_var"], usages)
+
+class UsagePlan:
+    """
+    The usage checks of an object: the lines creating it, and a check for every function and method accepting it.
+    The checks of functions or methods are None, if they could not be generated (see error).
+    """
+
+    def __init__(self, prefix_lines: List[str], functions: Optional[List[Check]], methods: Optional[List[Check]], error: str = None):
+        self.prefix_lines = prefix_lines
+        self.functions = functions
+        self.methods = methods
+        self.error = error
+
+    def count(self) -> int:
+        """Returns the number of usage checks."""
+        return len(self.functions or []) + len(self.methods or [])
+
+    def to_dict(self) -> dict:
+        return { "prefix_lines" : self.prefix_lines, "error" : self.error,
+                 "functions" : None if self.functions == None else [ check.to_dict() for check in self.functions ],
+                 "methods" : None if self.methods == None else [ check.to_dict() for check in self.methods ] }
+
+    @staticmethod
+    def from_dict(data: dict) -> UsagePlan:
+        functions = None if data["functions"] == None else [ Check.from_dict(check) for check in data["functions"] ]
+        methods = None if data["methods"] == None else [ Check.from_dict(check) for check in data["methods"] ]
+        return UsagePlan(data["prefix_lines"], functions, methods, data["error"])
+
+class Unit:
+    """
+    Checks, that are reported together: the checks of a method, a function or the usages of a type.
+    In incremental mode, no checks are planned for a unit whose fingerprint is unchanged (its stored results are reported).
+    """
+
+    def __init__(self, name: str, checks: List[Check],
+                    key: str = None,
+                    fingerprint: str = None,
+                    current: bool = False,
+                    error: str = None):
+        self.name = name
+        self.checks = checks
+        self.key = key # Key of the unit in the incremental state
+        self.fingerprint = fingerprint
+        self.current = current # The stored results of the unit are reported
+        self.error = error # No template was found while generating the checks following the planned ones
+
+    def count(self) -> int:
+        """Returns the number of checks, including all usage checks of return values."""
+        return sum(check.count() for check in self.checks)
+
+    def to_dict(self) -> dict:
+        return { "name" : self.name, "checks" : [ check.to_dict() for check in self.checks ], "key" : self.key,
+                 "fingerprint" : self.fingerprint, "current" : self.current, "error" : self.error }
+
+    @staticmethod
+    def from_dict(data: dict) -> Unit:
+        return Unit(data["name"], [ Check.from_dict(check) for check in data["checks"] ],
+                    data["key"], data["fingerprint"], data["current"], data["error"])
+
+class TypePlan:
+    """The checks of a type: a unit for each of its methods, and optionally a unit for its usages."""
+
+    def __init__(self, name: str, methods: List[Unit], usages: Unit = None, usage_plan: UsagePlan = None):
+        self.name = name
+        self.methods = methods
+        self.usages = usages # Unit of the usage checks (None: usages are not checked)
+        self.usage_plan = usage_plan # The usage checks of the type
+
+    def count(self) -> int:
+        return sum(unit.count() for unit in self.methods) + (0 if self.usage_plan == None else self.usage_plan.count())
+
+    def to_dict(self) -> dict:
+        return { "name" : self.name, "methods" : [ unit.to_dict() for unit in self.methods ],
+                 "usages" : None if self.usages == None else self.usages.to_dict(),
+                 "usage_plan" : None if self.usage_plan == None else self.usage_plan.to_dict() }
+
+    @staticmethod
+    def from_dict(data: dict) -> TypePlan:
+        return TypePlan(data["name"], [ Unit.from_dict(unit) for unit in data["methods"] ],
+                        None if data["usages"] == None else Unit.from_dict(data["usages"]),
+                        None if data["usage_plan"] == None else UsagePlan.from_dict(data["usage_plan"]))
+
+class FunctionPlan:
+    """The checks of a function. Checks of project() are run in an empty buildfile (see BuildFile.isolated())."""
+
+    def __init__(self, unit: Unit, is_project_func: bool = False):
+        self.name = unit.name
+        self.unit = unit
+        self.is_project_func = is_project_func
+
+    def count(self) -> int:
+        return self.unit.count()
+
+    def to_dict(self) -> dict:
+        return { "unit" : self.unit.to_dict(), "is_project_func" : self.is_project_func }
+
+    @staticmethod
+    def from_dict(data: dict) -> FunctionPlan:
+        return FunctionPlan(Unit.from_dict(data["unit"]), data["is_project_func"])
+
+class Plan:
+    """The checks of all selected types and functions."""
+
+    def __init__(self, types: List[TypePlan], functions: List[FunctionPlan], all_combinations: int = None):
+        self.types = types
+        self.functions = functions
+        self.all_combinations = all_combinations # Number of checks of functions and methods, if all parameter combinations were checked
+
+    def count(self) -> int:
+        """Returns the number of checks, including all usage checks of return values."""
+        return sum(plan.count() for plan in self.types) + sum(plan.count() for plan in self.functions)
+
+    def save(self, path: str):
+        """Writes the plan to a JSON file."""
+        with open(path, "w") as file:
+            json.dump({ "version" : PLAN_VERSION, "types" : [ plan.to_dict() for plan in self.types ],
+                        "functions" : [ plan.to_dict() for plan in self.functions ],
+                        "all_combinations" : self.all_combinations,
+                        # Required to tell generated names apart from other identifiers (see util.canonicalize())
+                        "names" : sorted(util.generated_names) }, file)
+
+    @staticmethod
+    def load(path: str) -> Plan:
+        """Reads a plan from a JSON file."""
+        with open(path, "r") as file:
+            data = json.load(file)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version '{data.get('version')}' (expected {PLAN_VERSION}).")
+        util.generated_names.update(data["names"])
+        return Plan([ TypePlan.from_dict(plan) for plan in data["types"] ],
+                    [ FunctionPlan.from_dict(plan) for plan in data["functions"] ], data.get("all_combinations"))
+
+    def print_summary(self):
+        """Prints the number of checks of every callable, and the total number of checks."""
+        def print_unit(unit: Unit, indent: str, name: str):
+            if unit.current:
+                print(f"{indent}{name}: unchanged (stored results are reported)")
+                return
+            usage_checks = sum(0 if check.usages == None else check.usages.count() for check in unit.checks)
+            line = f"{indent}{name}: {_checks(len(unit.checks))}"
+            if usage_checks > 0:
+                line += f" (+ up to {_checks(usage_checks)} of the usages of return values)"
+            if unit.error != None:
+                line += f" - {unit.error}"
+            print(line)
+
+        for plan in self.types:
+            print(f"Type {plan.name}:")
+            for unit in plan.methods:
+                print_unit(unit, "\t", f"{plan.name}.{unit.name}")
+            if plan.usages == None:
+                continue
+            elif plan.usages.current:
+                print_unit(plan.usages, "\t", "usages")
+            elif plan.usages.error != None:
+                print(f"\tusages: {_checks(0)} - {plan.usages.error}")
+            elif plan.usage_plan == None:
+                print(f"\tusages: {_checks(0)} (usages of built-in types are not checked)")
+            else:
+                line = f"\tusages: {_checks(plan.usage_plan.count())}"
+                print(line if plan.usage_plan.error == None else f"{line} - {plan.usage_plan.error}")
+        for plan in self.functions:
+            print_unit(plan.unit, "", f"{plan.name}()")
+
+        invocations = self._count_invocations()
+        print(f"In total, {_checks(self.count())} planned: {_checks(invocations)} of functions and methods, {_checks(self.count() - invocations)} of usages.")
+        self.print_reduction()
+
+    def print_reduction(self):
+        """Prints how many checks of functions and methods were saved by not checking all parameter combinations."""
+        invocations = self._count_invocations()
+        if self.all_combinations == None or self.all_combinations <= invocations:
+            return
+        saved = self.all_combinations - invocations
+        print(f"Not checking all parameter combinations saves {saved} of {_checks(self.all_combinations)} "
+              f"of functions and methods ({100 * saved / self.all_combinations:.0f}%).")
+
+    def _count_invocations(self) -> int:
+        return sum(len(unit.checks) for plan in self.types for unit in plan.methods) + sum(len(plan.unit.checks) for plan in self.functions)
+
+class Consumer:
+    """A function or method (owner is the type of the method), and the parameters of its parameter combinations, that accept a type."""
+
+    def __init__(self, clb, owner, slots: List[Tuple[List[inspect.Parameter], List[inspect.Parameter]]]):
+        self.clb = clb
+        self.owner = owner
+        self.slots = slots # Each parameter combination that accepts the type, and its parameters accepting the type
+
+class ConsumerIndex:
+    """
+    Index from a type to its consumers: the functions and methods with parameters that accept an object of the type.
+    The parameter combinations of all callables are only generated once, and the consumers of a type are only searched
+    once per run, instead of for every usage check.
+    """
+
+    def __init__(self, combinations: str = "full"):
+        # Every function and the methods of every type, in the order their usages are checked
+        callables = [ (func, None) for func in util.get_functions() ]
+        callables += [ (mm, obj) for obj in util.get_objects() for name, mm in inspect.getmembers(obj, predicate=util.ismultimethod) ]
+        # clb might be a multimethod
+        self.callables = [ (clb, owner, [ list(param_combination) for func in (get_methods(clb) if isinstance(clb, multimethod) else (clb,))
+                                            for param_combination in get_parameter_combinations(func, combinations) ])
+                            for clb, owner in callables ]
+        # All parameter annotations of each callable, a callable without an accepting one is not searched
+        self.annotations = [ frozenset(param.annotation for param_combination in param_combinations for param in param_combination)
+                                for clb, owner, param_combinations in self.callables ]
+        self.consumers = dict()
+        self.lattice = classification_lattice()
+
+    def prefetch(self, types):
+        """Searches the consumers of several types at once: callables that accept none of the types are skipped for all of them."""
+        types = [ T for T in types if T not in self.consumers ]
+        accepting = self.lattice.accepting_any(types)
+        candidates = [ i for i, annotations in enumerate(self.annotations) if not annotations.isdisjoint(accepting) ]
+        for T in types:
+            self.consumers[T] = self._search(T, candidates)
+
+    def get(self, T) -> List[Consumer]:
+        """Returns the consumers of type T."""
+        if T not in self.consumers:
+            self.consumers[T] = self._search(T, range(len(self.callables)))
+        return self.consumers[T]
+
+    def _search(self, T, candidates) -> List[Consumer]:
+        """Returns the consumers of type T among the callables with the given indices."""
+        consumers = []
+        # The annotations accepting the type are looked up once, instead of comparing each parameter with the type
+        accepting = self.lattice.accepting(T)
+        for i in candidates:
+            if self.annotations[i].isdisjoint(accepting):
+                continue
+            clb, owner, param_combinations = self.callables[i]
+            slots = []
+            for param_combination in param_combinations:
+                # Parameters that accept the type and don't require a special template
+                matching_params = [ param for param in param_combination if param.annotation in accepting
+                                    and not templates.has_special_template(T, param.name, clb) ]
+                if len(matching_params) != 0:
+                    slots.append((param_combination, matching_params))
+            if len(slots) != 0:
+                consumers.append(Consumer(clb, owner, slots))
+        return consumers
+
+class Planner:
+    """Generates the checks of types and functions (see generators.py)."""
+
+    def __init__(self, check_type_usages: bool = False,
+                    check_return_usages: bool = False,
+                    combinations: str = "full",
+                    full_returntype_check: bool = False,
+                    incremental: IncrementalState = None):
+        self.check_type_usages = check_type_usages # Check usages of types
+        self.check_return_usages = check_return_usages # Check usages of return values
+        self.combinations = combinations # Strategy for choosing parameter combinations (see util.COMBINATIONS)
+        self.full_returntype_check = full_returntype_check # Call every method of a return type, not only the discriminating ones
+        self.incremental = incremental # Don't plan checks of units whose fingerprint is unchanged
+        self.all_combinations = 0 # Number of all parameter combinations of the planned methods and functions
+        self.consumers = None # Index of the consumers of types, only built if usages are checked (see ConsumerIndex)
+
+    def plan(self, types, funcs) -> Plan:
+        """Returns the plan for the given types and functions."""
+        # The consumers of all checked types are searched at once
+        if self.check_type_usages:
+            self._consumer_index().prefetch([ T for T in types if T not in default_types ])
+        plan = Plan([ self.plan_type(T) for T in types ], [ self.plan_function(func) for func in funcs ])
+        plan.all_combinations = self.all_combinations
+        self.all_combinations = 0
+        return plan
+
+    def _unit(self, name: str, key: str, fingerprint) -> Unit:
+        """Returns an empty unit. The fingerprint is a callable, it is only evaluated in incremental mode."""
+        if self.incremental == None:
+            return Unit(name, [])
+        fingerprint = fingerprint()
+        return Unit(name, [], key, fingerprint, self.incremental.is_current(key, fingerprint))
+
+    def _plan_call(self, key: str, name: str, generator: FunctionGenerator, return_type, parameter_combination,
+                    receiver: str = None, inline: bool = False) -> Check:
+        """Returns the check of a call generated by the generator. The key identifies the check (see util.naming_scope())."""
+        # Names of the check must not be used by the object it is called on
+        with naming_scope(key, reserved=canonicalize([receiver or ""])[1]):
+            return self._generate_call(key, name, generator, return_type, parameter_combination, receiver, inline)
+
+    def _generate_call(self, key: str, name: str, generator: FunctionGenerator, return_type, parameter_combination,
+                        receiver: str, inline: bool) -> Check:
+        returncheck_required = return_type not in (typing.Any, type(None)) # Dont do returntype check if returntype is any or none
+
+        # Dont add a return variable if it is not required
+        return_var = varname() if returncheck_required else None
+        call_lines = generator.generate_lines(return_var, inline=inline)
+
+        # Generate lines for a returntype check if required
+        returncheck_lines = []
+        if returncheck_required:
+            return_gen = ReturnTypeGenerator(return_type, return_var, self.combinations, self.full_returntype_check)
+            returncheck_lines += return_gen.generate_lines()
+
+        check = Check(name, pretty_print_func(name, parameter_combination), call_lines, receiver, returncheck_lines, return_var)
+        # If required, also check the usages of the returned value
+        if return_var != None and self.check_return_usages:
+            check.usages = self.plan_usages(f"{key}:usages", return_type, return_var, check.lines())
+        return check
+
+    def plan_type(self, T) -> TypePlan:
+        """Returns the checks of the methods (and optionally the usages) of the type."""
+        methods = []
+        for name, mm in inspect.getmembers(T, predicate=ismultimethod):
+            key = f"method:{T.__name__}.{name}"
+            unit = self._unit(name, key, lambda: callable_fingerprint(mm, T, self.check_return_usages))
+            methods.append(unit)
+            if unit.current:
+                continue
+            try:
+                # Check each method
+                for method in get_methods(mm):
+                    return_type = get_type(inspect.signature(method).return_annotation)
+                    """
+                    Since parameters can be optional, there are multiple combinations of parameters that
+                    need to be tested.
+                    """
+                    self.all_combinations += count_parameter_combinations(method)
+                    for parameter_combination in get_parameter_combinations(method, self.combinations):
+                        # Create object, each check gets its own (batched checks must not declare the same target twice)
+                        with naming_scope(f"{key}:{len(unit.checks)}:obj"):
+                            obj_template = templates.get_template(T, name=templates.OBJECT, special_templates_key=mm)
+                        method_check = MethodGenerator(name, "obj", parameter_combination, special_templates_key=mm)
+                        unit.checks.append(self._plan_call(f"{key}:{len(unit.checks)}", name, method_check, return_type, parameter_combination,
+                                                            receiver=obj_template))
+            except TemplateNotFoundException as e:
+                # The following methods are not checked
+                unit.error = str(e)
+                break
+
+        if not self.check_type_usages:
+            return TypePlan(T.__name__, methods)
+
+        key = f"usage:{T.__name__}"
+        usages = self._unit("usages", key, lambda: usage_fingerprint(T))
+        usage_plan = None
+        if not usages.current:
+            try:
+                with naming_scope(key):
+                    obj_template = templates.get_template(T)
+                usage_plan = self.plan_usages(key, T, "obj", [f"obj = {obj_template}"])
+            except TemplateNotFoundException as e:
+                usages.error = str(e)
+        return TypePlan(T.__name__, methods, usages, usage_plan)
+
+    def plan_function(self, func) -> FunctionPlan:
+        """Returns the checks of the function."""
+        func_name = util.get_name(func)
+        key = f"function:{func_name}"
+        unit = self._unit(func_name, key, lambda: callable_fingerprint(func, check_return_usages=self.check_return_usages))
+
+        # Check if function is project()-call (Requires special buildfile)
+        is_project_func = func_name == "project"
+        if unit.current:
+            return FunctionPlan(unit, is_project_func)
+
+        functions = get_methods(func) if isinstance(func, multimethod) else (func,)
+        try:
+            for method in functions:
+                return_type = get_type(inspect.signature(method).return_annotation)
+                """
+                Since parameters can be optional, there are multiple combinations of parameters that
+                need to be tested.
+                """
+                self.all_combinations += count_parameter_combinations(method)
+                for parameter_combination in get_parameter_combinations(method, self.combinations):
+                    func_check = FunctionGenerator(func_name, parameter_combination, special_templates_key=func)
+                    unit.checks.append(self._plan_call(f"{key}:{len(unit.checks)}", func_name, func_check, return_type, parameter_combination,
+                                                        inline=is_project_func))
+        # No check of the function is run
+        except TemplateNotFoundException as e:
+            unit.checks = []
+            unit.error = str(e)
+        return FunctionPlan(unit, is_project_func)
+
+    def plan_usages(self, key: str, T, obj_var: str, prefix_lines: List[str]) -> Optional[UsagePlan]:
+        """
+        Returns the usage checks of an object of type T, which is created by the prefix lines (None for built-in types,
+        their usages are not checked). The key identifies the usage checks (see util.naming_scope()).
+        """
+        # Skip usage check on built-in types like string and boolean
+        if T in default_types:
+            return None
+        consumers = self._consumer_index().get(T)
+        usage_plan = UsagePlan(prefix_lines, None, None)
+        try:
+            usage_plan.functions = self._plan_usage_checks(key, obj_var, prefix_lines, [ c for c in consumers if c.owner == None ])
+            # Check usage for every method of every object
+            usage_plan.methods = self._plan_usage_checks(key, obj_var, prefix_lines, [ c for c in consumers if c.owner != None ])
+        except TemplateNotFoundException as e:
+            usage_plan.error = str(e)
+        return usage_plan
+
+    def _consumer_index(self) -> ConsumerIndex:
+        """Returns the index of the consumers of types (built on first use)."""
+        if self.consumers == None:
+            self.consumers = ConsumerIndex(self.combinations)
+        return self.consumers
+
+    def _plan_usage_checks(self, key: str, obj_var: str, prefix_lines: List[str], consumers: List[Consumer]) -> List[Check]:
+        """Generates checks, whether object can be used in the consumers of its type"""
+        checks = []
+        # Names of the checks must not be used by the prefix lines
+        reserved = canonicalize(prefix_lines)[1]
+        for consumer in consumers:
+            owner = "" if consumer.owner == None else f"{consumer.owner.__name__}."
+            with naming_scope(f"{key}:{owner}{util.get_name(consumer.clb)}", reserved=reserved):
+                checks.append(self._plan_usage_check(obj_var, consumer))
+        return checks
+
+    def _plan_usage_check(self, obj_var: str, consumer: Consumer) -> Check:
+        """Generates a check, whether object can be used in each parameter combination of the consumer, that accepts its type."""
+        # Some functions might take an array of this type, so add an array that wraps this variable
+        arr_var = varname()
+        lines = [ f"{arr_var} = [{obj_var}]" ]
+        clb, oftype = consumer.clb, consumer.owner
+        func_name = util.get_name(clb)
+
+        for param_combination, matching_params in consumer.slots:
+            # Create existing_objects dict for functions, where they look up if an object already exists
+            # or a new one has to be made via templates
+            existing_objects = {param.name : arr_var if util.isarray(param.annotation) else obj_var for param in matching_params}
+
+            # Create lines for a function call, using this object as an argument
+            if oftype != None:
+                method_obj_name = varname() # variable name for object
+                method_obj_template = templates.get_template(oftype, name=templates.OBJECT, special_templates_key=clb)
+                lines.append(f"{method_obj_name} = {method_obj_template}")
+                gen = MethodGenerator(func_name, method_obj_name, param_combination,
+                    special_templates_key=clb,
+                    existing_objects=existing_objects)
+            else:
+                gen = FunctionGenerator(func_name, param_combination,
+                    special_templates_key=clb,
+                    existing_objects=existing_objects)
+
+            lines += gen.generate_lines(None)
+
+        return Check(func_name, func_name, lines)
\ No newline at end of file
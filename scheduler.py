@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import io, queue, sys, threading
+from typing import Callable, List
+from buildfile import BuildFile
+from util import yellow
+from workspace import DiskBudgetExceeded
+
+"""
+The scheduler distributes jobs (usually one TypeChecker or FunctionChecker run)
+onto a pool of workers. Each worker owns a separate BuildFile, so no two
+checks ever share a meson.build file or build directory.
+Everything a job prints is buffered and written to stdout in the order the
+jobs were submitted, so the output looks exactly like the one of a serial run.
+"""
+
+class ThreadLocalStdout:
+    """
+    Replacement for sys.stdout, that redirects writes of a thread into its own buffer (if one is set).
+    Additionally, a thread can record its output into further buffers (see record()).
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def set_buffer(self, buffer):
+        """Redirects all output of the current thread into buffer. Pass None to restore stdout."""
+        self.local.buffer = buffer
+
+    def record(self, buffer):
+        """Copies all output of the current thread into buffer, until stop_recording() is called."""
+        if not hasattr(self.local, "recordings"):
+            self.local.recordings = []
+        self.local.recordings.append(buffer)
+
+    def stop_recording(self, buffer):
+        """Stops copying output into buffer."""
+        self.local.recordings.remove(buffer)
+
+    def write(self, string: str) -> int:
+        for recording in getattr(self.local, "recordings", []):
+            recording.write(string)
+        buffer = getattr(self.local, "buffer", None)
+        return (self.stdout if buffer == None else buffer).write(string)
+
+    def flush(self):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer == None:
+            self.stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+class CheckPool:
+    """
+    Runs jobs on a pool of buildfiles. A job is a callable, that receives the buildfile it should use.
+    With more than one buildfile, jobs run in worker threads at once. A buildfile (and its backend) is only used
+    by one worker at a time, everything shared by the workers is guarded by its own lock: the counters of Log,
+    the ResultMemo and the ResultCache, the IncrementalState, the StubTable and the WorkspaceManager.
+    sys.stdout is replaced by a ThreadLocalStdout while jobs run, so each job prints into its own buffer.
+    """
+
+    def __init__(self, buildfiles: List[BuildFile]):
+        if len(buildfiles) == 0:
+            raise ValueError("A CheckPool requires at least one buildfile.")
+        self.buildfiles = buildfiles
+
+    def run(self, jobs: List[Callable[[BuildFile], None]]) -> bool:
+        """Runs all jobs and prints their output in submission order. Returns False, if the run was interrupted."""
+        stdout = sys.stdout
+        sys.stdout = ThreadLocalStdout(stdout)
+        try:
+            # With a single buildfile, run everything in the main thread (-> no buffering required)
+            if len(self.buildfiles) == 1:
+                return self._run_serial(jobs)
+            return self._run_parallel(jobs, stdout)
+        finally:
+            sys.stdout = stdout
+
+    def _run_serial(self, jobs: List[Callable[[BuildFile], None]]) -> bool:
+        try:
+            for job in jobs:
+                job(self.buildfiles[0])
+        except KeyboardInterrupt:
+            print(f"{yellow('INTERNAL')}:: KeyboardInterrupt {' '*10}")
+            return False
+        except DiskBudgetExceeded as e:
+            print(f"{yellow('INTERNAL')}:: {e}")
+            return False
+        return True
+
+    def _run_parallel(self, jobs: List[Callable[[BuildFile], None]], stdout) -> bool:
+        job_queue = queue.Queue()
+        for index, job in enumerate(jobs):
+            job_queue.put((index, job))
+
+        outputs = [None] * len(jobs)
+        done = [threading.Event() for job in jobs]
+        stop = threading.Event()
+
+        def worker(bf: BuildFile):
+            while True:
+                try:
+                    index, job = job_queue.get_nowait()
+                except queue.Empty:
+                    return
+                # Jobs of a stopped run are not run, but marked as done (without output)
+                if stop.is_set():
+                    outputs[index] = ""
+                    done[index].set()
+                    continue
+                buffer = io.StringIO()
+                sys.stdout.set_buffer(buffer)
+                try:
+                    job(bf)
+                # Stops the whole run, all workspaces count towards the budget
+                except DiskBudgetExceeded as e:
+                    print(f"{yellow('INTERNAL')}:: {e}")
+                    stop.set()
+                except Exception as e:
+                    print(f"{yellow('INTERNAL')}:: {type(e).__name__}: {e}")
+                finally:
+                    sys.stdout.set_buffer(None)
+                    outputs[index] = buffer.getvalue()
+                    done[index].set()
+
+        # Daemon threads, so that a second interrupt does not wait for running checks
+        threads = [threading.Thread(target=worker, args=(bf,), daemon=True) for bf in self.buildfiles]
+        for thread in threads:
+            thread.start()
+
+        try:
+            # Print outputs as soon as all previous jobs are finished
+            for index in range(len(jobs)):
+                done[index].wait()
+                stdout.write(outputs[index])
+                stdout.flush()
+            return not stop.is_set()
+        except KeyboardInterrupt:
+            stop.set()
+            print(f"{yellow('INTERNAL')}:: KeyboardInterrupt {' '*10}", file=stdout)
+            # Running jobs still use their buildfiles, so they must finish before the buildfiles are reused or closed
+            for thread in threads:
+                thread.join()
+            return False
\ No newline at end of file
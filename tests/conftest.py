@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import json, os, sys
+import pytest
+
+# The modules of the tool are not a package, they are imported from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import templates # Has to be imported before buildfile (circular import)
+from backends import StubBackend, StubTable
+from buildfile import BuildFile
+from cache import ResultMemo
+
+"""
+Fixtures for tests without meson: buildfiles use the stub backend, which answers
+checks from the rules of a StubTable (see backends.py).
+"""
+
+class CountingBackend(StubBackend):
+    """Stub backend, that keeps the lines of every check it answers. Checks are batched like with a meson backend."""
+
+    requires_meson = True
+
+    def __init__(self, bf, table: StubTable):
+        super().__init__(bf, table)
+        self.calls = []
+
+    def check(self, lines, timeout=None):
+        self.calls.append(list(lines))
+        return super().check(lines, timeout)
+
+@pytest.fixture
+def make_table(tmp_path):
+    """Returns a function, that creates a StubTable: each line matching a pattern fails with its message, other lines succeed."""
+    def make(rules: dict = {}, name: str = "stub.json") -> StubTable:
+        path = tmp_path / name
+        with open(path, "w") as file:
+            json.dump({ "rules" : [ { "pattern" : pattern, "message" : message } for pattern, message in rules.items() ],
+                        "default" : [ -1, "" ] }, file)
+        return StubTable(str(path))
+    return make
+
+@pytest.fixture
+def make_buildfile():
+    """Returns a function, that creates a buildfile answering checks from the table (its backend counts the checks)."""
+    buildfiles = []
+    def make(table: StubTable, **settings) -> BuildFile:
+        settings.setdefault("memo", ResultMemo())
+        bf = BuildFile(backend="stub", stub_table=table, quiet=True, **settings)
+        bf.backend = CountingBackend(bf, table)
+        buildfiles.append(bf)
+        return bf
+    yield make
+    for bf in buildfiles:
+        bf.close()
\ No newline at end of file
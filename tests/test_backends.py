@@ -0,0 +1,89 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import signal, subprocess, time
+import pytest
+from backends import StubTable
+from buildfile import BuildFile
+from util import varname
+
+def meson_available() -> bool:
+    try:
+        return subprocess.run(["meson", "--version"], capture_output=True).returncode == 0
+    except OSError:
+        return False
+
+requires_meson = pytest.mark.skipif(not meson_available(), reason="meson is not available")
+
+def test_lookup_without_entry_or_rule_is_a_miss():
+    table = StubTable()
+    assert table.lookup("project('generated', ['c'])", ["x = 1"]) == None
+
+def test_stub_miss_is_reported_as_failure(make_buildfile):
+    bf = make_buildfile(StubTable())
+    error_line, error_msg = bf.check_lines(["x = 1"])
+    assert error_line == 0
+    assert "<STUB MISS>" in error_msg
+
+def test_first_matching_rule_wins(make_table):
+    table = make_table({ "foo" : "no foo", "bar" : "no bar" })
+    assert table.lookup("", ["x = 1", "y = bar + foo", "z = foo"]) == (1, "no foo")
+
+def test_recording_replays_with_other_names(tmp_path, make_table, make_buildfile):
+    record_table = StubTable(str(tmp_path / "record.json"))
+    bf = make_buildfile(make_table({ r"fail\(" : "failed" }), record_table=record_table)
+    name = varname()
+    bf.check_lines([f"{name} = fail()"])
+    # Results of the memo are recorded aswell
+    bf.check_lines([f"{varname()} = 1"])
+    bf.check_lines([f"{varname()} = 1"])
+    record_table.save()
+
+    replay = make_buildfile(StubTable(str(tmp_path / "record.json")))
+    assert replay.check_lines([f"{varname()} = fail()"]) == (0, "failed")
+    assert replay.check_lines([f"{varname()} = 1"]) == (-1, "")
+    assert len(replay.backend.table.table) == 2
+
+@pytest.fixture
+def meson_buildfile():
+    """Returns a function, that creates a buildfile checked by the subprocess backend."""
+    buildfiles = []
+    def make(**settings) -> BuildFile:
+        bf = BuildFile(backend="subprocess", quiet=True, **settings)
+        buildfiles.append(bf)
+        return bf
+    yield make
+    for bf in buildfiles:
+        bf.close()
+
+@requires_meson
+def test_verbose_output_reports_the_same_result(meson_buildfile, capsys):
+    lines = ["x = 1", "warning('first warning')", "warning('second warning')", "error('real error')"]
+    quiet = meson_buildfile(warnings=True).check_lines(lines)
+    verbose = meson_buildfile(warnings=True, verbose=True).check_lines(lines)
+    assert quiet[0] == verbose[0] == 0
+    assert quiet[1] == verbose[1] and "first warning" in quiet[1]
+
+@requires_meson
+def test_interrupt_kills_running_check(meson_buildfile):
+    bf = meson_buildfile()
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt()
+    handler = signal.signal(signal.SIGALRM, interrupt)
+    start = time.monotonic()
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 1)
+        with pytest.raises(KeyboardInterrupt):
+            bf.check_lines(["run_command('sleep', '10', check: false)"])
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, handler)
+    # Meson runs in its own session, it has to be killed instead of being waited for
+    assert time.monotonic() - start < 5
+
+@requires_meson
+def test_timeout_is_reported(meson_buildfile):
+    error_line, error_msg = meson_buildfile(timeout=1).check_lines(["run_command('sleep', '10', check: false)"])
+    assert error_line < -1
+    assert "<TIMEOUT>" in error_msg
\ No newline at end of file
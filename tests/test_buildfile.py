@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from cache import ResultCache, ResultMemo
+from util import varname
+
+RULES = { r"fail\(" : "failed" }
+
+SNIPPETS = [ ["a = 1"], ["b = fail()"], ["c = 3"], ["d = 4"], ["e = fail()", "f = 6"] ]
+
+def test_batch_matches_single_checks(make_table, make_buildfile):
+    table = make_table(RULES)
+    single = make_buildfile(table).check_batch(SNIPPETS, ["x = 0"])
+    batched = make_buildfile(table, batch_size=4).check_batch(SNIPPETS, ["x = 0"])
+    assert single == [ (-1, ""), (1, "failed"), (-1, ""), (-1, ""), (1, "failed") ]
+    assert batched == single
+
+def test_batch_reruns_failing_snippet(make_table, make_buildfile):
+    bf = make_buildfile(make_table(RULES), batch_size=4)
+    bf.check_batch(SNIPPETS[:4], ["x = 0"])
+    # The group, the failing snippet on its own, then the remaining snippets as a new group
+    assert bf.backend.calls == [ ["x = 0", "a = 1", "b = fail()", "c = 3", "d = 4"],
+                                 ["x = 0", "b = fail()"],
+                                 ["x = 0", "c = 3", "d = 4"] ]
+
+def test_batch_first_snippet_failure_is_not_rerun(make_table, make_buildfile):
+    bf = make_buildfile(make_table(RULES), batch_size=4)
+    assert bf.check_batch([ ["b = fail()"], ["c = 3"] ]) == [ (0, "failed"), (-1, "") ]
+    assert bf.backend.calls == [ ["b = fail()", "c = 3"], ["c = 3"] ]
+
+def test_terminating_snippet_is_checked_alone(make_table, make_buildfile):
+    bf = make_buildfile(make_table(RULES), batch_size=4)
+    bf.check_batch([ ["a = 1"], ["error('stop')"], ["c = 3"] ])
+    assert bf.backend.calls == [ ["a = 1"], ["error('stop')"], ["c = 3"] ]
+
+def test_checks_differing_in_generated_names_run_once(make_table, make_buildfile):
+    bf = make_buildfile(make_table(RULES))
+    first, second = varname(), varname()
+    assert bf.check_lines([f"{first} = fail()"]) == (0, "failed")
+    assert bf.check_lines([f"{second} = fail()"]) == (0, "failed")
+    assert len(bf.backend.calls) == 1
+
+def test_batched_duplicates_run_once(make_table, make_buildfile):
+    bf = make_buildfile(make_table(RULES), batch_size=16)
+    snippets = [ [f"{varname()} = 1"] for i in range(3) ] + [ [f"{varname()} = 1"] for i in range(3) ]
+    assert bf.check_batch(snippets) == [ (-1, "") ] * 6
+    assert len(bf.backend.calls) == 1
+
+def test_cache_is_shared_between_runs(tmp_path, make_table, make_buildfile):
+    table = make_table(RULES)
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    try:
+        make_buildfile(table, cache=cache).check_lines([f"{varname()} = fail()"])
+        bf = make_buildfile(table, cache=cache, memo=ResultMemo())
+        assert bf.check_lines([f"{varname()} = fail()"]) == (0, "failed")
+        assert bf.backend.calls == []
+    finally:
+        cache.close()
+
+def test_batch_successes_are_only_cached_for_the_first_snippet(tmp_path, make_table, make_buildfile):
+    table = make_table(RULES)
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    try:
+        make_buildfile(table, cache=cache, batch_size=4).check_batch(SNIPPETS[2:4])
+        # Another run doesn't trust the success of a snippet, that only succeeded after other snippets
+        bf = make_buildfile(table, cache=cache, memo=ResultMemo())
+        assert bf.check_batch(SNIPPETS[2:4]) == [ (-1, ""), (-1, "") ]
+        assert bf.backend.calls == [ ["d = 4"] ]
+    finally:
+        cache.close()
\ No newline at end of file
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import inspect, itertools
+import pytest
+import util
+from plan import ConsumerIndex, Planner, default_types
+
+def all_methods():
+    """Every function and every method of every type (the methods of multimethods)."""
+    callables = util.get_functions() + [ mm for T in util.get_objects() for name, mm in inspect.getmembers(T, predicate=util.ismultimethod) ]
+    return [ method for clb in callables for method in (util.get_methods(clb) if util.ismultimethod(clb) else (clb,)) ]
+
+def digits(space: util.ParameterSpace, combination) -> tuple:
+    """Returns the index of the chosen variant of each parameter of the combination."""
+    return tuple(choices.index(param) for choices, param in zip(space.choices, combination))
+
+@pytest.mark.parametrize("strategy", [ "pairwise", "single" ])
+def test_strategies_cover_all_variants(strategy):
+    strength = 2 if strategy == "pairwise" else 1
+    for method in all_methods():
+        space = util.parameter_space(method)
+        rows = [ digits(space, combination) for combination in space.select(strategy) ]
+        assert len(rows) <= len(space)
+        for positions in itertools.combinations(range(len(space.radices)), strength):
+            required = set(itertools.product(*[ range(space.radices[i]) for i in positions ]))
+            covered = { tuple(row[i] for i in positions) for row in rows }
+            assert covered == required, f"{method.__qualname__}: {sorted(required - covered)} not covered"
+
+def test_full_plan_checks_every_combination():
+    plan = Planner(combinations="full").plan([], util.get_functions())
+    assert plan._count_invocations() == plan.all_combinations
+    assert plan.count() == plan._count_invocations()
+
+@pytest.mark.parametrize("strategy", [ "pairwise", "single" ])
+def test_reduced_plan_counts(strategy):
+    funcs = util.get_functions()
+    plan = Planner(combinations=strategy).plan([], funcs)
+    methods = [ method for func in funcs for method in (util.get_methods(func) if util.ismultimethod(func) else (func,)) ]
+    assert plan.all_combinations == sum(len(util.parameter_space(method)) for method in methods)
+    assert plan._count_invocations() == sum(len(list(util.get_parameter_combinations(method, strategy))) for method in methods)
+    assert plan._count_invocations() < plan.all_combinations
+
+def test_usage_plan_counts_match_consumers():
+    types = [ T for T in util.get_objects() if T not in default_types ]
+    plan = Planner(check_type_usages=True).plan(types, [])
+    index = ConsumerIndex()
+    for T, type_plan in zip(types, plan.types):
+        if type_plan.usage_plan == None or type_plan.usage_plan.error != None:
+            continue
+        # A single check calls a consumer with each of its parameter combinations, that accepts the type
+        assert type_plan.usage_plan.count() == len(index.get(T)), T.__name__
+
+def test_prefetched_consumers_match_single_searches():
+    types = [ T for T in util.get_objects() if T not in default_types ]
+    prefetched, single = ConsumerIndex(), ConsumerIndex()
+    prefetched.prefetch(types)
+    for T in types:
+        assert [ (c.clb, c.owner, c.slots) for c in prefetched.get(T) ] == [ (c.clb, c.owner, c.slots) for c in single.get(T) ]
\ No newline at end of file
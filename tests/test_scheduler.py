@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import time
+from cache import ResultMemo
+from scheduler import CheckPool
+
+def make_jobs(count: int):
+    """Jobs printing several lines and the results of checks. Later jobs finish first, if they run at once."""
+    def job(index: int):
+        def run(bf):
+            print(f"Job {index}:")
+            time.sleep(0.01 * (count - index))
+            for line in (f"x{index} = 1", f"y{index} = fail()"):
+                print(f"\t{line} -> {bf.check_lines([line])}")
+        return run
+    return [ job(index) for index in range(count) ]
+
+def run_pool(capsys, buildfiles, jobs) -> str:
+    capsys.readouterr()
+    assert CheckPool(buildfiles).run(jobs)
+    return capsys.readouterr().out
+
+def test_parallel_output_matches_serial(capsys, make_table, make_buildfile):
+    table = make_table({ r"fail\(" : "failed" })
+    serial = run_pool(capsys, [ make_buildfile(table) ], make_jobs(8))
+    memo = ResultMemo()
+    parallel = run_pool(capsys, [ make_buildfile(table, memo=memo) for i in range(3) ], make_jobs(8))
+    assert parallel == serial
+    assert [ line for line in serial.split("\n") if line.startswith("Job") ] == [ f"Job {index}:" for index in range(8) ]
+
+def test_stopped_run_reports_interruption(capsys, make_table, make_buildfile):
+    table = make_table()
+    def interrupt(bf):
+        raise KeyboardInterrupt()
+    jobs = make_jobs(2) + [ interrupt ] + make_jobs(2)
+    capsys.readouterr()
+    assert not CheckPool([ make_buildfile(table) ]).run(jobs)
+    assert "KeyboardInterrupt" in capsys.readouterr().out
+
+def test_failing_job_is_reported_in_order(capsys, make_table, make_buildfile):
+    table = make_table()
+    def failing(bf):
+        print("Job failing:")
+        raise ValueError("broken template")
+    jobs = make_jobs(2) + [ failing ] + make_jobs(2)
+    output = run_pool(capsys, [ make_buildfile(table) for i in range(2) ], jobs)
+    lines = output.split("\n")
+    assert lines.index("Job failing:") + 1 == lines.index(next(line for line in lines if "ValueError: broken template" in line))
+    assert [ line for line in lines if line.startswith("Job") ] == [ "Job 0:", "Job 1:", "Job failing:", "Job 0:", "Job 1:" ]
\ No newline at end of file
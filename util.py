@@ -2,7 +2,8 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import multimethod, objects, functions, random, inspect, string, typing, re
+import multimethod, objects, functions, random, inspect, string, typing, re, contextlib, functools, hashlib, threading
+from typing import Iterator, List, Optional, Tuple
 
 def ismultimethod(obj) -> bool:
     """Returns whether the given object is a multimethod"""
@@ -121,52 +122,252 @@ def pretty_print_type(T) -> str:
     else:
         return T.__name__
 
+# All names returned by varname(), so that they can be told apart from other identifiers (see canonicalize())
+generated_names = set()
+
+# A name returned by varname(), and a placeholder for it in a canonical line
+GENERATED_NAME = re.compile(r"\b[a-zA-Z]{10}\b")
+NAME_PLACEHOLDER = re.compile(r"\$NAME(\d+)\$")
+
+# Characters of generated names
+NAME_ALPHABET = string.ascii_lowercase + string.ascii_uppercase
+NAME_LENGTH = 10
+
+class NameScope:
+    """
+    Generates the names of a check deterministically: the n-th name is derived from the counter n by a bijective
+    mapping, that depends on the seed and the key of the check. So the names of a check are unique, the same check
+    always gets the same names, and different checks get different names (with overwhelming probability).
+    Reserved names (e.g. those of the prefix lines of a check) are skipped.
+    """
+
+    # Number of possible names
+    NAMES = len(NAME_ALPHABET) ** NAME_LENGTH
+
+    def __init__(self, seed: int, key: str, reserved: List[str] = []):
+        digest = hashlib.sha256(f"{seed}:{key}".encode()).digest()
+        self.offset = int.from_bytes(digest[:16], "little") % NameScope.NAMES
+        # The factor has to be coprime to the number of names (52^10 = 2^20 * 13^10)
+        self.factor = int.from_bytes(digest[16:], "little") % NameScope.NAMES | 1
+        if self.factor % 13 == 0:
+            self.factor = (self.factor + 2) % NameScope.NAMES
+        self.counter = 0
+        self.reserved = set(reserved)
+
+    def next(self) -> str:
+        """Returns the next name of the check."""
+        while True:
+            number = (self.factor * self.counter + self.offset) % NameScope.NAMES
+            self.counter += 1
+            name = ""
+            for i in range(NAME_LENGTH):
+                number, digit = divmod(number, len(NAME_ALPHABET))
+                name += NAME_ALPHABET[digit]
+            if name not in self.reserved:
+                return name
+
+# Seed of deterministic names (None: names are random), see set_seed()
+seed = None
+
+# Stack of the active naming scopes of each thread
+scopes = threading.local()
+
+def set_seed(value: Optional[int]):
+    """Enables deterministic names (see NameScope) with the given seed. Pass None to generate random names."""
+    global seed
+    seed = value
+
+@contextlib.contextmanager
+def naming_scope(key: str, reserved: List[str] = []):
+    """Names returned by varname() in this context are deterministic (if a seed is set), see NameScope."""
+    if seed == None:
+        yield
+        return
+    if not hasattr(scopes, "stack"):
+        scopes.stack = []
+    scopes.stack.append(NameScope(seed, key, reserved))
+    try:
+        yield
+    finally:
+        scopes.stack.pop()
+
 def varname() -> str:
-    """Returns a random string with length 10. Can be used as a variable name inside Meson."""
-    return "".join(random.choices(string.ascii_lowercase + string.ascii_uppercase, k=10))
+    """Returns a random string with length 10 (deterministic in a naming scope). Can be used as a variable name inside Meson."""
+    stack = getattr(scopes, "stack", [])
+    if len(stack) > 0:
+        name = stack[-1].next()
+    else:
+        name = "".join(random.choices(NAME_ALPHABET, k=NAME_LENGTH))
+    generated_names.add(name)
+    return name
 
-def get_parameter_combinations(method):
-    """Returns all combinations of parameters of the given method."""
-    # Store each combination of parameter types
-    # Each parameter consists of (type of parameter, kind of parameter {keyword, positional, ...})
-    combinations = [[]]
+def canonicalize(lines: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Replaces the names generated by varname() with placeholders, that are numbered in the order of their
+    first occurrence. Lines that only differ in generated names are identical afterwards.
+    Returns the canonical lines and the replaced names (the index of a name is the number of its placeholder).
+    """
+    names = {}
+    def replace(match):
+        name = match.group(0)
+        if name not in generated_names:
+            return name
+        if name not in names:
+            names[name] = len(names)
+        return f"$NAME{names[name]}$"
+    return [ GENERATED_NAME.sub(replace, line) for line in lines ], list(names)
+
+def canonicalize_names(string: str, names: List[str]) -> str:
+    """Replaces the given names (see canonicalize()) in a string (e.g. an error message) with their placeholders."""
+    indices = { name : index for index, name in enumerate(names) }
+    return GENERATED_NAME.sub(lambda match: f"$NAME{indices[match.group(0)]}$" if match.group(0) in indices else match.group(0), string)
+
+def restore_names(string: str, names: List[str]) -> str:
+    """Replaces the placeholders in a string with the given names (see canonicalize())."""
+    return NAME_PLACEHOLDER.sub(lambda match: names[int(match.group(1))] if int(match.group(1)) < len(names) else match.group(0), string)
 
+# Strategies for choosing the parameter combinations of a callable (see get_parameter_combinations()):
+#   full:     every combination of parameter types
+#   pairwise: every pair of types of two parameters appears in at least one combination
+#   single:   every type of each parameter appears in at least one combination
+COMBINATIONS = [ "full", "pairwise", "single" ]
+
+def get_parameter_choices(method) -> List[List[inspect.Parameter]]:
+    """Returns the variants of each parameter of the given method (one for each type of a Union)."""
+    choices = []
     for param in inspect.signature(method).parameters.values():
         param_type = get_type(param.annotation)
-            
+
         """
         Some methods have Union[...] or Optional[...] as
         type annotation (Optional[T] -> Union[T, None]).
         In this case, we need to check every possible
         combination of parameter types.
+        If NoneType is in the variant, only keyword-arguments
+        are added afterwards (see generators.py).
         """
-        if typing.get_origin(param_type) is typing.Union:
-            """
-            For each current parameter variant create
-            a new variant for each type in the union.
-            If NoneType is already in the variant, only
-            add keyword-arguments
-            """
-            new_combinations = []
-            for combination in combinations:
-                for arg in typing.get_args(param_type):
-                    # If arg is 'Any', just use a parameter
-                    # of type Number (no check is required here)
-                    new_param = param.replace(annotation=objects.Number) if arg is typing.Any else param.replace(annotation=arg)
-                    new_combinations.append(combination + [new_param])
-            combinations = new_combinations
-
-        # Otherwise, just append the parameter to all variants
-        else:
-            for combination in combinations:
-                # If param_type is 'Any', just use a parameter
-                # of type Number (no check is required here)
-                if param_type is typing.Any:
-                    param_type = objects.Number
-                new_param = param.replace(annotation=param_type)
-                combination.append(new_param)
-
-    return combinations
+        args = typing.get_args(param_type) if typing.get_origin(param_type) is typing.Union else (param_type,)
+
+        # If arg is 'Any', just use a parameter
+        # of type Number (no check is required here)
+        choices.append([ param.replace(annotation=objects.Number if arg is typing.Any else arg) for arg in args ])
+    return choices
+
+def covering_array(radices: List[int], strength: int = 2) -> List[List[int]]:
+    """
+    Returns combinations of indices (the index at position i is smaller than radices[i]), in which every
+    combination of two indices at different positions (strength 2), or every single index (strength 1) appears at least once.
+    Pairs are covered with the IPO strategy: starting with all pairs of the first two positions, each further position
+    is added to the existing combinations (choosing the index that covers most new pairs), and combinations are added
+    for the pairs that are still missing.
+    """
+    if strength == 1 or len(radices) < 2:
+        return [ [ row % radix for radix in radices ] for row in range(max(radices, default=1)) ]
+
+    rows = [ [a, b] for a in range(radices[0]) for b in range(radices[1]) ]
+    for i in range(2, len(radices)):
+        uncovered = { (j, vj, vi) for j in range(i) for vj in range(radices[j]) for vi in range(radices[i]) }
+
+        # Horizontal growth: extend each combination by the index, that covers most uncovered pairs
+        for row in rows:
+            value = max(range(radices[i]), key=lambda vi: sum((j, row[j], vi) in uncovered for j in range(i)))
+            row.append(value)
+            uncovered -= { (j, row[j], value) for j in range(i) }
+
+        # Vertical growth: add combinations for the remaining pairs (None: any index)
+        new_rows = []
+        for j, vj, vi in sorted(uncovered):
+            for row in new_rows:
+                if row[i] == vi and row[j] == None:
+                    row[j] = vj
+                    break
+            else:
+                row = [None] * i + [vi]
+                row[j] = vj
+                new_rows.append(row)
+        rows += new_rows
+
+    return [ [ 0 if value == None else value for value in row ] for row in rows ]
+
+class ParameterSpace:
+    """
+    All combinations of parameters of a callable, without creating them in advance: each parameter has an array
+    of choices (see get_parameter_choices()), and each combination is identified by a mixed-radix index, whose
+    digits are the indices of the chosen variants (the last parameter is the least significant digit, so indices
+    are in the order of itertools.product()).
+    Combinations are only created when they are iterated or accessed by their index, so the space can also be
+    split between workers (see shard()) or resumed at any index.
+    """
+
+    def __init__(self, method):
+        self.choices = get_parameter_choices(method)
+        self.radices = [ len(param_choices) for param_choices in self.choices ]
+        self.size = 1
+        for radix in self.radices:
+            self.size *= radix
+
+    def __len__(self) -> int:
+        return self.size
+
+    def digits(self, index: int) -> List[int]:
+        """Returns the index of the chosen variant of each parameter, for the combination with the given index."""
+        if index < 0:
+            index += self.size
+        if index < 0 or index >= self.size:
+            raise IndexError(f"Combination index out of range ({self.size} combinations).")
+        digits = [0] * len(self.radices)
+        for i in reversed(range(len(self.radices))):
+            index, digits[i] = divmod(index, self.radices[i])
+        return digits
+
+    def index(self, digits: List[int]) -> int:
+        """Returns the index of the combination, that chooses the given variant of each parameter."""
+        index = 0
+        for digit, radix in zip(digits, self.radices):
+            index = index * radix + digit
+        return index
+
+    def combination(self, digits: List[int]) -> List[inspect.Parameter]:
+        """Returns the parameters of the combination, that chooses the given variant of each parameter."""
+        return [ self.choices[i][digit] for i, digit in enumerate(digits) ]
+
+    def __getitem__(self, index: int) -> List[inspect.Parameter]:
+        return self.combination(self.digits(index))
+
+    def __iter__(self) -> Iterator[List[inspect.Parameter]]:
+        return self.iterate()
+
+    def iterate(self, start: int = 0, stop: int = None, step: int = 1) -> Iterator[List[inspect.Parameter]]:
+        """Yields the combinations with the indices range(start, stop, step) (stop defaults to the number of combinations)."""
+        for index in range(start, self.size if stop == None else min(stop, self.size), step):
+            yield self[index]
+
+    def shard(self, worker: int, workers: int) -> Iterator[List[inspect.Parameter]]:
+        """Yields every workers-th combination, starting at index worker (the shards of all workers cover the space once)."""
+        return self.iterate(worker, None, workers)
+
+    def select(self, strategy: str = "full") -> Iterator[List[inspect.Parameter]]:
+        """Yields the combinations, that are chosen by the strategy (see COMBINATIONS)."""
+        if strategy == "full":
+            return iter(self)
+        elif strategy not in COMBINATIONS:
+            raise ValueError(f"Unknown strategy '{strategy}' for parameter combinations.")
+        rows = covering_array(self.radices, strength=1 if strategy == "single" else 2)
+        return (self.combination(row) for row in rows)
+
+@functools.lru_cache(maxsize=None)
+def parameter_space(method) -> ParameterSpace:
+    """Returns the space of all combinations of parameters of the given method."""
+    return ParameterSpace(method)
+
+def count_parameter_combinations(method) -> int:
+    """Returns the number of all combinations of parameters of the given method."""
+    return len(parameter_space(method))
+
+def get_parameter_combinations(method, strategy: str = "full") -> Iterator[List[inspect.Parameter]]:
+    """Yields the combinations of parameters of the given method, that are chosen by the strategy (see COMBINATIONS)."""
+    # Each parameter consists of (type of parameter, kind of parameter {keyword, positional, ...})
+    return parameter_space(method).select(strategy)
 
 def red(string: str) -> str:
     """Wraps the given string in terminal color code red"""
@@ -0,0 +1,265 @@
+# SPDX-FileCopyrightText: 2021 Paul Aumann
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import atexit, errno, fcntl, hashlib, itertools, json, os, shutil, signal, subprocess, tempfile, threading
+from typing import List, Optional
+
+"""
+Helpers for the directories checks are run in (source directory and build directory).
+Every check rewrites the meson.build file and the coredata of the build directory,
+so these directories can be put on a memory-backed file system (tmpfs) instead of a disk.
+Files that are only read by checks (the template files) are linked instead of copied.
+
+Additional workspaces are cloned from one that is already configured, so 'meson setup'
+is only run once, no matter how many buildfiles are used.
+A persistent workspace (see --workspace) is kept between runs, so that 'meson setup'
+(which detects the whole toolchain) only has to be run again when meson or the
+project languages change.
+All other workspaces are temporary: they are owned by a WorkspaceManager, which
+removes them when the tool exits.
+"""
+
+# Memory-backed file system, that is available on most linux systems
+MEMORY_DIR = "/dev/shm"
+
+def link_file(src_file: str, dest_file: str):
+    """Hardlinks a file. Creates a symlink instead, if a hardlink is not possible (e.g. on another file system)."""
+    try:
+        os.link(src_file, dest_file)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        os.symlink(os.path.abspath(src_file), dest_file)
+
+def link_tree(src: str, dest: str):
+    """Links a file, or all files of a directory into a copy of its directory structure."""
+    if not os.path.isdir(src):
+        link_file(src, dest)
+        return
+    shutil.copytree(src, dest, copy_function=link_file)
+
+def remove_path(path: str):
+    """Removes a file, link or directory if it exists."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def clone_builddir(src_dir: str, dest_dir: str, builddir: str = "builddir") -> bool:
+    """
+    Copies the configured build directory of the source directory src_dir into dest_dir (instead of running
+    'meson setup' again). Absolute paths of src_dir are rewritten in the copy. Returns False, if the coredata
+    references src_dir (it is pickled, so paths can't be rewritten); nothing is copied then.
+    """
+    src = os.path.join(src_dir, builddir)
+    dest = os.path.join(dest_dir, builddir)
+    remove_path(dest)
+
+    old_path = os.fsencode(os.path.abspath(src_dir))
+    new_path = os.fsencode(os.path.abspath(dest_dir))
+    # Check the coredata before copying, so that no configured looking copy is left behind
+    with open(os.path.join(src, "meson-private", "coredata.dat"), "rb") as file:
+        if old_path in file.read():
+            return False
+
+    # copy2 uses copy_file_range(), which creates reflinks on file systems supporting them
+    shutil.copytree(src, dest, symlinks=True)
+    for root, dirs, files in os.walk(dest):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                data = file.read()
+            if old_path not in data:
+                continue
+            # Other pickled files (build.dat, install.dat) are only written by meson, never read by a check
+            if name.endswith(".dat"):
+                os.remove(path)
+            else:
+                with open(path, "wb") as file:
+                    file.write(data.replace(old_path, new_path))
+    return True
+
+def meson_version() -> str:
+    """Returns the version of the meson executable."""
+    result = subprocess.run(["meson", "--version"], capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError("Could not determine the meson version.")
+    return result.stdout.decode().strip()
+
+class PersistentWorkspace:
+    """
+    A source directory (containing the build directory), that is kept between runs.
+    Workspaces are identified by a key (e.g. meson version and project languages). Each one is
+    locked while it is used, so several buildfiles (or runs) sharing the same root get different workspaces.
+    """
+
+    STAMP_FILE = "stamp.json"
+
+    def __init__(self, root: str, key: dict):
+        self.key = key
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        os.makedirs(root, exist_ok=True)
+
+        # Use the first workspace for the key, that is not locked by another buildfile
+        for index in itertools.count():
+            self.path = os.path.join(root, f"{digest}-{index}")
+            os.makedirs(self.path, exist_ok=True)
+            self.lock = open(os.path.join(self.path, "lock"), "w")
+            try:
+                fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                self.lock.close()
+
+        self.name = os.path.join(self.path, "src")
+        self.stamp = os.path.join(self.path, PersistentWorkspace.STAMP_FILE)
+        self.setup_output = self._load_stamp()
+        # Start from scratch, if the workspace was not configured (or for another key)
+        if self.setup_output == None:
+            remove_path(self.stamp)
+            remove_path(self.name)
+            os.makedirs(self.name)
+
+    def _load_stamp(self) -> Optional[str]:
+        """Returns the output of 'meson setup' stored in the stamp file, if the workspace is still valid."""
+        try:
+            with open(self.stamp, "r") as file:
+                stamp = json.load(file)
+        except (OSError, ValueError):
+            return None
+        coredata = os.path.join(self.name, "builddir", "meson-private", "coredata.dat")
+        if stamp.get("key") != self.key or not os.path.isfile(coredata):
+            return None
+        return stamp.get("setup_output")
+
+    def configured(self, setup_output: str):
+        """Marks the workspace as configured, after 'meson setup' has succeeded."""
+        self.setup_output = setup_output
+        with open(self.stamp, "w") as file:
+            json.dump({ "key" : self.key, "setup_output" : setup_output }, file)
+
+    def cleanup(self):
+        """Releases the workspace. The directories are kept for the next run."""
+        self.lock.close()
+
+class DiskBudgetExceeded(RuntimeError):
+    pass
+
+class TemporaryWorkspace:
+    """A source directory (containing the build directory), that is removed by its WorkspaceManager."""
+
+    def __init__(self, manager: "WorkspaceManager", path: str):
+        self.manager = manager
+        self.name = path
+
+    def cleanup(self):
+        """Removes the workspace."""
+        self.manager.remove(self)
+
+class WorkspaceManager:
+    """
+    Creates temporary workspaces and guarantees that they are removed again: on exit (even after an
+    unhandled exception), on SIGTERM and SIGHUP, and, if the tool was killed, on the next start
+    (workspaces of processes that don't exist anymore are swept).
+    The disk usage of all workspaces is limited by a budget.
+    """
+
+    # Prefix of all workspace directories, followed by the pid of the owning process
+    PREFIX = "meson-classification-checker-"
+
+    def __init__(self, root: str = None, budget: int = None):
+        self.root = tempfile.gettempdir() if root == None else root
+        self.budget = budget # Maximum size of all workspaces in bytes (None: unlimited)
+        self.workspaces: List[TemporaryWorkspace] = []
+        # Workspaces are created by several worker threads (e.g. isolated buildfiles, see BuildFile.isolated())
+        self.lock = threading.Lock()
+
+        atexit.register(self.cleanup)
+        # Signal handlers can only be installed by the main thread
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGHUP):
+                if signal.getsignal(signum) == signal.SIG_DFL:
+                    signal.signal(signum, WorkspaceManager._exit)
+
+    @staticmethod
+    def _exit(signum, frame):
+        # Exiting runs the atexit handlers, which remove the workspaces
+        raise SystemExit(128 + signum)
+
+    def sweep(self) -> int:
+        """Removes workspaces left behind by processes that don't exist anymore. Returns the number of removed workspaces."""
+        removed = 0
+        for name in os.listdir(self.root):
+            if not name.startswith(WorkspaceManager.PREFIX):
+                continue
+            pid = name[len(WorkspaceManager.PREFIX):].split("-")[0]
+            if not pid.isdigit() or int(pid) == os.getpid() or _process_exists(int(pid)):
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            removed += 1
+        return removed
+
+    def create(self) -> TemporaryWorkspace:
+        """Creates an empty workspace."""
+        path = tempfile.mkdtemp(prefix=f"{WorkspaceManager.PREFIX}{os.getpid()}-", dir=self.root)
+        workspace = TemporaryWorkspace(self, path)
+        with self.lock:
+            self.workspaces.append(workspace)
+        return workspace
+
+    def usage(self) -> int:
+        """Returns the disk usage of all workspaces in bytes. Files that are linked into workspaces are counted once."""
+        with self.lock:
+            paths = [ workspace.name for workspace in self.workspaces ]
+        inodes = set()
+        size = 0
+        for path in paths:
+            for root, dirs, files in os.walk(path):
+                for name in files:
+                    try:
+                        stat = os.lstat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    if (stat.st_dev, stat.st_ino) in inodes:
+                        continue
+                    inodes.add((stat.st_dev, stat.st_ino))
+                    size += stat.st_blocks * 512
+        return size
+
+    def check_budget(self, workspace: TemporaryWorkspace = None):
+        """
+        Raises DiskBudgetExceeded, if the budget is exceeded. The given workspace (e.g. one that was just
+        populated and will not be used) is removed first.
+        """
+        if self.budget == None:
+            return
+        usage = self.usage()
+        if usage > self.budget:
+            if workspace != None:
+                self.remove(workspace)
+            raise DiskBudgetExceeded(f"Workspaces use {usage / 2**20:.1f} MiB, the disk budget is {self.budget / 2**20:.1f} MiB.")
+
+    def remove(self, workspace: TemporaryWorkspace):
+        """Removes a workspace."""
+        with self.lock:
+            if workspace not in self.workspaces:
+                return
+            self.workspaces.remove(workspace)
+        shutil.rmtree(workspace.name, ignore_errors=True)
+
+    def cleanup(self):
+        """Removes all workspaces."""
+        with self.lock:
+            workspaces = list(self.workspaces)
+        for workspace in workspaces:
+            self.remove(workspace)
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
\ No newline at end of file